@@ -1,14 +1,15 @@
 """mesa_geo Agent-Based Modeling Framework.
 
-Core Objects: GeoSpace, GeoAgent
+Core Objects: GeoSpace, GeoAgent, PointAgent, PointLayer
 
 """
 import datetime
 
-from mesa_geo.geoagent import GeoAgent, AgentCreator
+from mesa_geo.geoagent import GeoAgent, PointAgent, AgentCreator
 from mesa_geo.geospace import GeoSpace
+from mesa_geo.pointlayer import PointLayer
 
-__all__ = ["GeoSpace", "GeoAgent", "AgentCreator"]
+__all__ = ["GeoSpace", "GeoAgent", "PointAgent", "AgentCreator", "PointLayer"]
 
 __title__ = "mesa-geo"
 __version__ = "0.1.2"
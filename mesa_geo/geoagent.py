@@ -1,20 +1,27 @@
 """
 The geoagent class for the mesa_geo framework.
 
-Core Objects: GeoAgent
+Core Objects: GeoAgent, PointAgent
 
 """
 import json
 import geopandas as gpd
 from mesa import Agent
 from shapely.ops import transform
-from shapely.geometry import mapping
+from shapely.geometry import Point, mapping
 from shapely.geometry.base import BaseGeometry
 import warnings
 
 
 class GeoAgent(Agent):
-    """Base class for a geo model agent."""
+    """Base class for a geo model agent.
+
+    `unique_id` and `model` are slots. The shape is kept in the `__dict__`
+    that mesa's Agent gives every instance, so that PointAgent, which keeps
+    its point as two floats, does not carry unused slots.
+    """
+
+    __slots__ = ("unique_id", "model")
 
     def __init__(self, unique_id, model, shape):
         """Create a new agent.
@@ -37,7 +44,7 @@ class GeoAgent(Agent):
 
         Removes shape from attributes.
         """
-        properties = dict(vars(self))
+        properties = attributes(self)
         properties["model"] = str(self.model)
         shape = properties.pop("shape")
 
@@ -46,6 +53,70 @@ class GeoAgent(Agent):
         return {"type": "Feature", "geometry": mapping(shape), "properties": properties}
 
 
+class PointAgent(GeoAgent):
+    """GeoAgent with a point shape, kept as two floats.
+
+    The coordinates are stored in the `x` and `y` slots, and the shapely
+    Point is only built when `shape` is read, e.g. by a spatial index or a
+    renderer. It is dropped again when the agent moves with `set_xy`.
+    Subclasses list their own attributes in `__slots__` too. Instances still
+    have a `__dict__`, as mesa's Agent has no `__slots__`, but it stays empty
+    and CPython only allocates it when it is read, e.g. by `attributes`.
+    """
+
+    __slots__ = ("x", "y", "_shape")
+
+    def __init__(self, unique_id, model, shape):
+        """Create a new point agent.
+
+        unique_id: Id of agent. Uniqueness is not guaranteed!
+        model: The associated model of the agent
+        shape: A Shapely Point
+        """
+        self.unique_id = unique_id
+        self.model = model
+        self.x = shape.x
+        self.y = shape.y
+        self._shape = None
+
+    @property
+    def shape(self):
+        if self._shape is None:
+            self._shape = Point(self.x, self.y)
+        return self._shape
+
+    @shape.setter
+    def shape(self, shape):
+        self.x = shape.x
+        self.y = shape.y
+        self._shape = shape
+
+    def set_xy(self, x, y):
+        """Move the agent to (x, y), without building a Point."""
+        self.x = x
+        self.y = y
+        self._shape = None
+
+
+def attributes(agent):
+    """Attributes of an agent as a dict, from its `__dict__` and its `__slots__`.
+
+    The `x`, `y` and cached shape of a PointAgent are left out, its `shape` is
+    included as for any other GeoAgent.
+    """
+    values = {}
+    for cls in reversed(type(agent).__mro__):
+        for name in cls.__dict__.get("__slots__", ()):
+            if hasattr(agent, name):
+                values[name] = getattr(agent, name)
+    values.update(getattr(agent, "__dict__", {}))
+    if isinstance(agent, PointAgent):
+        for name in ("x", "y", "_shape"):
+            values.pop(name, None)
+        values["shape"] = agent.shape
+    return values
+
+
 class AgentCreator:
     """Create GeoAgents from files, GeoDataFrames, GeoJSON or Shapely objects."""
 
@@ -1,14 +1,220 @@
+import math
+
+import numpy as np
 import pyproj
+import shapely
 from libpysal import weights
 from rtree import index
-from shapely.geometry import Point
+from shapely.geometry import Point, mapping
 from shapely.prepared import prep
 
-from mesa_geo.geoagent import GeoAgent
+from mesa_geo.geoagent import GeoAgent, PointAgent, attributes
+
+
+def _bounds(agent):
+    """Bounds of an agent, without building the shape of a PointAgent."""
+    if isinstance(agent, PointAgent):
+        return (agent.x, agent.y, agent.x, agent.y)
+    return agent.shape.bounds
+
+
+def _point_xy(agent):
+    """Coordinates of a point agent, without building the shape of a PointAgent."""
+    if isinstance(agent, PointAgent):
+        return agent.x, agent.y
+    return agent.shape.x, agent.shape.y
+
+
+class LooseRTree:
+    """R-tree index for moving agents with inflated (loose) bounds.
+
+    Every agent is stored with its bounds grown by `slack` on each side, so
+    small moves stay inside the stored box. Inserting, moving and removing
+    agents only updates their boxes: the tree is bulk loaded again from the
+    boxes on the first query after a change, as deleting from a large R-tree
+    one agent at a time costs far more than a bulk load.
+    """
+
+    def __init__(self, slack=0.0):
+        """Create an empty loose R-tree.
+
+        Args:
+            slack: Distance added to each side of an agent's bounds.
+        """
+        self.slack = slack
+        self.idx = index.Index()
+        self.agents = {}
+        self._bounds = {}
+        self._stale = False
+
+    def _loose_bounds(self, agent):
+        minx, miny, maxx, maxy = _bounds(agent)
+        return (minx - self.slack, miny - self.slack,
+                maxx + self.slack, maxy + self.slack)
+
+    def insert(self, agent):
+        """Add an agent to the index."""
+        self.agents[id(agent)] = agent
+        self._bounds[id(agent)] = self._loose_bounds(agent)
+        self._stale = True
+
+    def remove(self, agent):
+        """Remove an agent from the index."""
+        del self._bounds[id(agent)]
+        del self.agents[id(agent)]
+        self._stale = True
+
+    def update(self, agent):
+        """Reindex an agent whose shape has changed, if it left its slack."""
+        old = self._bounds[id(agent)]
+        minx, miny, maxx, maxy = _bounds(agent)
+        if old[0] <= minx and old[1] <= miny and maxx <= old[2] and maxy <= old[3]:
+            return
+        self._bounds[id(agent)] = self._loose_bounds(agent)
+        self._stale = True
+
+    def rebuild(self):
+        """Bulk load a fresh tree from the current agent shapes."""
+        self._bounds = {
+            key: self._loose_bounds(agent) for key, agent in self.agents.items()
+        }
+        self._load()
+
+    def _load(self):
+        """Bulk load the tree from the stored boxes."""
+        if self._bounds:
+            self.idx = index.Index((key, bounds, None) for key, bounds in self._bounds.items())
+        else:
+            self.idx = index.Index()
+        self._stale = False
+
+    def intersection(self, bounds):
+        """Return candidate agents whose loose bounds intersect `bounds`."""
+        if self._stale:
+            self._load()
+        return (self.agents[i] for i in self.idx.intersection(bounds))
+
+    @property
+    def bounds(self):
+        """Bounding box of all loose bounds, i.e. including the slack."""
+        if not self.agents:
+            return None
+        boxes = np.array(list(self._bounds.values()))
+        return np.concatenate((boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0))).tolist()
+
+
+class SpatialHash:
+    """Uniform grid (cell list) index for moving point agents.
+
+    Agents are bucketed by the cell that contains their point. Moving an
+    agent only touches the two buckets involved, and a query only visits
+    the cells overlapped by its bounds.
+    """
+
+    def __init__(self, cell_size=5.0):
+        """Create an empty spatial hash.
+
+        Args:
+            cell_size: Edge length of the square cells, in CRS units. A
+                cell size close to the usual query radius works best.
+        """
+        self.cell_size = cell_size
+        self.agents = {}
+        self._cells = {}
+        self._cell_of = {}
+
+    def _cell(self, x, y):
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def insert(self, agent):
+        """Add a point agent to the hash."""
+        if not isinstance(agent, PointAgent) and agent.shape.geom_type != "Point":
+            raise TypeError("SpatialHash only supports point agents")
+        cell = self._cell(*_point_xy(agent))
+        self._cells.setdefault(cell, {})[id(agent)] = agent
+        self._cell_of[id(agent)] = cell
+        self.agents[id(agent)] = agent
+
+    def remove(self, agent):
+        """Remove an agent from the hash."""
+        cell = self._cell_of.pop(id(agent))
+        bucket = self._cells[cell]
+        del bucket[id(agent)]
+        if not bucket:
+            del self._cells[cell]
+        del self.agents[id(agent)]
+
+    def update(self, agent):
+        """Move an agent to the bucket of its current position."""
+        cell = self._cell(*_point_xy(agent))
+        old = self._cell_of[id(agent)]
+        if cell == old:
+            return
+        bucket = self._cells[old]
+        del bucket[id(agent)]
+        if not bucket:
+            del self._cells[old]
+        self._cells.setdefault(cell, {})[id(agent)] = agent
+        self._cell_of[id(agent)] = cell
+
+    def rebuild(self):
+        """Rebucket every agent from its current position."""
+        agents = list(self.agents.values())
+        self.agents = {}
+        self._cells = {}
+        self._cell_of = {}
+        for agent in agents:
+            self.insert(agent)
+
+    def _buckets(self, bounds):
+        min_cx, min_cy = self._cell(bounds[0], bounds[1])
+        max_cx, max_cy = self._cell(bounds[2], bounds[3])
+        if (max_cx - min_cx + 1) * (max_cy - min_cy + 1) > len(self._cells):
+            # Large query: cheaper to filter the occupied cells
+            for (cx, cy), bucket in self._cells.items():
+                if min_cx <= cx <= max_cx and min_cy <= cy <= max_cy:
+                    yield bucket
+        else:
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    bucket = self._cells.get((cx, cy))
+                    if bucket:
+                        yield bucket
+
+    def intersection(self, bounds):
+        """Return candidate agents in the cells overlapped by `bounds`."""
+        for bucket in self._buckets(bounds):
+            yield from bucket.values()
+
+    def within_distance(self, x, y, distance):
+        """Return agents whose point lies within `distance` of (x, y)."""
+        bounds = (x - distance, y - distance, x + distance, y + distance)
+        distance_sq = distance * distance
+        for bucket in self._buckets(bounds):
+            for agent in bucket.values():
+                agent_x, agent_y = _point_xy(agent)
+                dx = agent_x - x
+                dy = agent_y - y
+                if dx * dx + dy * dy <= distance_sq:
+                    yield agent
+
+    @property
+    def bounds(self):
+        """Bounding box of all occupied cells."""
+        if not self._cells:
+            return None
+        xs = [cx for cx, _ in self._cells]
+        ys = [cy for _, cy in self._cells]
+        return [
+            min(xs) * self.cell_size,
+            min(ys) * self.cell_size,
+            (max(xs) + 1) * self.cell_size,
+            (max(ys) + 1) * self.cell_size,
+        ]
 
 
 class GeoSpace:
-    def __init__(self, crs="epsg:3857"):
+    def __init__(self, crs="epsg:3857", slack=0.0, dynamic_index="rtree", cell_size=5.0):
         """Create a GeoSpace for GIS enabled mesa modeling.
 
         Args:
@@ -16,16 +222,32 @@ class GeoSpace:
                 If `crs` is not set, epsg:3857 (Web Mercator) is used as default.
                 However, this system is only accurate at the equator and errors
                 increase with latitude.
+            slack: Distance by which the bounds of moving agents are inflated
+                in their index. A moving agent is only reindexed once it has
+                moved past its slack.
+            dynamic_index: Index used for moving agents, either "rtree" (a
+                loose R-tree) or "hash" (a uniform grid for point agents).
+            cell_size: Cell size of the "hash" index.
 
         Properties:
             crs: Project coordinate reference system
-            idx: R-tree index for fast spatial queries
+            idx: R-tree index of static agents, built once
+            dynamic_idx: Index of moving agents (LooseRTree or SpatialHash),
+                kept up to date through `move_agent`
             bbox: Bounding box of all agents within the GeoSpace
             agents: List of all agents in the Geospace
+            static_agents: List of the agents in the static index
+            dynamic_agents: List of the moving agents
+            layers: PointLayers of the GeoSpace by name, kept apart from the
+                agents and their indexes
 
         Methods:
             add_agents: add a list or a single GeoAgent.
             remove_agent: Remove a single agent from GeoSpace
+            remove_agents: Remove a list of agents from GeoSpace
+            move_agent: Move a single agent and update the index
+            move_point: Move a point agent to new coordinates and update the index
+            add_layer: Add a read-only PointLayer of static points
             agents_at: List all agents at a specific position
             distance: Calculate distance between two agents
             get_neighbors: Returns a list of (touching) neighbors
@@ -33,6 +255,10 @@ class GeoSpace:
             get_agents_within: Returns a list of agents within
             get_agent_contains: Returns a list of agents contained
             get_agents_touches: Returns a list of agents that touch
+            query: Returns index pairs of many geometries and the agents they relate to
+            query_points: Same as query, for arrays of point coordinates
+            get_features: Returns GeoJSON Features of agents, transformed in bulk
+            get_layer_features: Returns GeoJSON Features of the points of a layer
             update_bbox: Update the bounding box of the GeoSpace
         """
         self.crs = pyproj.CRS(crs)
@@ -44,32 +270,116 @@ class GeoSpace:
         self.bbox = None
         self._neighborhood = None
 
-        # Set up rtree index
+        # WGS84 GeoJSON geometries of static agents, by agent id, with the shape they were made from
+        self._geometry_cache = {}
+
+        # Set up rtree index for static agents
         self.idx = index.Index()
         self.idx.agents = {}
+        # Shapely STRtree of the static agents for bulk queries, built on first use
+        self._static_tree = None
+        # Static points that are not agents, by layer name
+        self.layers = {}
 
-    def add_agents(self, agents):
+        # Moving agents are indexed separately and updated incrementally
+        if dynamic_index == "rtree":
+            self.dynamic_idx = LooseRTree(slack)
+        elif dynamic_index == "hash":
+            self.dynamic_idx = SpatialHash(cell_size)
+        else:
+            raise ValueError("dynamic_index must be 'rtree' or 'hash'")
+
+    def add_agents(self, agents, dynamic=False):
         """Add a list of GeoAgents to the Geospace.
 
         GeoAgents must have a shape attribute. This function may also be called
-        with a single GeoAgent."""
+        with a single GeoAgent.
+
+        Args:
+            agents: A GeoAgent or a list of GeoAgents
+            dynamic: Set True for agents that move. They are kept in a
+                separate index that is updated through `move_agent`, so the
+                static index never has to be rebuilt.
+        """
         if isinstance(agents, GeoAgent):
-            agent = agents
-            if hasattr(agent, "shape"):
-                self.idx.insert(id(agent), agent.shape.bounds, None)
-                self.idx.agents[id(agent)] = agent
-            else:
+            agents = [agents]
+        for agent in agents:
+            if not isinstance(agent, PointAgent) and not hasattr(agent, "shape"):
                 raise AttributeError("GeoAgents must have a shape attribute")
+
+        if dynamic:
+            for agent in agents:
+                self.dynamic_idx.insert(agent)
+        elif len(agents) == 1:
+            agent = agents[0]
+            self.idx.insert(id(agent), _bounds(agent), None)
+            self.idx.agents[id(agent)] = agent
+            self._static_tree = None
         else:
             self._recreate_rtree(agents)
 
         self.update_bbox()
 
+    def add_layer(self, name, layer):
+        """Add a PointLayer to the GeoSpace.
+
+        The points of a layer are not agents: they are not in the indexes
+        and not returned by the agent queries, and are looked up through the
+        layer itself, e.g. `space.layers[name].nearest(x, y)`. They extend
+        the bounding box of the GeoSpace.
+
+        Args:
+            name: Name of the layer, unique within the GeoSpace
+            layer: A PointLayer
+        """
+        if name in self.layers:
+            raise ValueError("The GeoSpace already has a layer named {}".format(name))
+        self.layers[name] = layer
+        self.update_bbox()
+
     def remove_agent(self, agent):
         """Remove an agent from the GeoSpace."""
-        self.idx.delete(id(agent), agent.shape.bounds)
+        self.remove_agents([agent])
+
+    def remove_agents(self, agents):
+        """Remove a list of agents from the GeoSpace, and update the bounding box once."""
+        for agent in agents:
+            if id(agent) in self.dynamic_idx.agents:
+                self.dynamic_idx.remove(agent)
+            else:
+                self.idx.delete(id(agent), _bounds(agent))
+                del self.idx.agents[id(agent)]
+                self._static_tree = None
+            self._geometry_cache.pop(id(agent), None)
         self.update_bbox()
 
+    def move_agent(self, agent, shape):
+        """Move an agent to a new shape and keep the index in sync.
+
+        Moving agents are only reindexed once they leave their slack. Static
+        agents are deleted and reinserted in the static index.
+        """
+        if id(agent) in self.dynamic_idx.agents:
+            agent.shape = shape
+            self.dynamic_idx.update(agent)
+        else:
+            self.idx.delete(id(agent), agent.shape.bounds)
+            agent.shape = shape
+            self.idx.insert(id(agent), agent.shape.bounds, None)
+            self._static_tree = None
+
+    def move_point(self, agent, x, y):
+        """Move a point agent to (x, y) and keep the index in sync.
+
+        A PointAgent only gets new coordinates, its Point is built when it is
+        next needed. Other agents get a new Point.
+        """
+        if not isinstance(agent, PointAgent) or id(agent) not in self.dynamic_idx.agents:
+            self.move_agent(agent, Point(x, y))
+            return
+        agent.set_xy(x, y)
+        self.dynamic_idx.update(agent)
+
     def get_relation(self, agent, relation):
         """Return a list of related agents.
 
@@ -88,7 +398,9 @@ class GeoSpace:
 
     def _get_rtree_intersections(self, shape):
         """Calculate rtree intersections for candidate agents."""
-        return (self.idx.agents[i] for i in self.idx.intersection(shape.bounds))
+        bounds = shape.bounds
+        yield from (self.idx.agents[i] for i in self.idx.intersection(bounds))
+        yield from self.dynamic_idx.intersection(bounds)
 
     def get_intersecting_agents(self, agent, other_agents=None):
         intersecting_agents = self.get_relation(agent, "intersects")
@@ -99,7 +411,19 @@ class GeoSpace:
 
         Distance is measured as a buffer around the agent's shape,
         set center=True to calculate distance from center.
+
+        With the "hash" index, point agents are answered by a plain distance
+        test over the adjacent cells instead of a buffered polygon.
         """
+        if (
+            isinstance(self.dynamic_idx, SpatialHash)
+            and not center
+            and relation == "intersects"
+            and (isinstance(agent, PointAgent) or agent.shape.geom_type == "Point")
+        ):
+            yield from self._get_points_within_distance(*_point_xy(agent), distance)
+            return
+
         if center:
             shape = agent.shape.center().buffer(distance)
         else:
@@ -110,6 +434,73 @@ class GeoSpace:
             if getattr(prepared_shape, relation)(other_agent.shape):
                 yield other_agent
 
+    def _get_points_within_distance(self, x, y, distance):
+        """Return agents within `distance` of a point without a buffer."""
+        bounds = (x - distance, y - distance, x + distance, y + distance)
+        point = None
+        for i in self.idx.intersection(bounds):
+            other_agent = self.idx.agents[i]
+            if isinstance(other_agent, PointAgent):
+                # Same arithmetic as the point to point distance of GEOS
+                dx = other_agent.x - x
+                dy = other_agent.y - y
+                if math.sqrt(dx * dx + dy * dy) <= distance:
+                    yield other_agent
+                continue
+            if point is None:
+                point = Point(x, y)
+            if point.distance(other_agent.shape) <= distance:
+                yield other_agent
+        yield from self.dynamic_idx.within_distance(x, y, distance)
+
+    def query(self, geometries, predicate="intersects", distance=None, agents=None):
+        """Relate many geometries to agents with one vectorized STRtree query.
+
+        Each pair is one geometry and one agent for which
+        `predicate(geometry, agent.shape)` holds, e.g. with "within" the
+        geometry lies within the agent. "dwithin" pairs every geometry with
+        the agents within `distance` of it.
+
+        Args:
+            geometries: Array or list of shapely geometries
+            predicate: Shapely STRtree predicate, e.g. "intersects", "within",
+                "contains", "touches" or "dwithin"
+            distance: Distance for the "dwithin" predicate
+            agents: Agents to relate the geometries to. Omit to use the static
+                agents, in the order of `static_agents`, whose tree is kept
+                until they change.
+
+        Returns:
+            Two integer arrays of the same length, the index of the geometry
+            and the index of the agent of every pair, sorted by geometry
+        """
+        if agents is None:
+            if self._static_tree is None:
+                self._static_tree = shapely.STRtree([agent.shape for agent in self.idx.agents.values()])
+            tree = self._static_tree
+        else:
+            tree = shapely.STRtree([agent.shape for agent in agents])
+        if predicate == "dwithin" and distance is None:
+            raise ValueError("The dwithin predicate needs a distance")
+        geometries = np.asarray(geometries, dtype=object)
+        geometry_index, agent_index = tree.query(geometries, predicate=predicate, distance=distance)
+        return geometry_index, agent_index
+
+    def query_points(self, x, y, predicate="intersects", distance=None, agents=None):
+        """Relate many points, given as coordinate arrays, to agents.
+
+        Same as `query`, e.g. `query_points(x, y, agents=safe_areas)` pairs
+        every point with the safe areas it lies in, and
+        `query_points(x, y, "dwithin", 5, sand)` with the sand areas within 5
+        of it.
+
+        Args:
+            x: Array of x coordinates
+            y: Array of y coordinates
+        """
+        return self.query(shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float)),
+                          predicate, distance, agents)
+
     def agents_at(self, pos):
         """Return a list of agents at given pos."""
         if not isinstance(pos, Point):
@@ -141,34 +532,134 @@ class GeoSpace:
         return neighbors
 
     def _recreate_rtree(self, new_agents=None):
-        """Create a new rtree index from agents shapes."""
+        """Create a new rtree index from agents shapes.
+
+        Static agents are bulk loaded into a new index. Moving agents only
+        need this if their shapes were changed without `move_agent`.
+        """
 
         if new_agents is None:
             new_agents = []
-        old_agents = list(self.agents)
+            self.dynamic_idx.rebuild()
+        old_agents = list(self.idx.agents.values())
         agents = old_agents + new_agents
 
         # Bulk insert agents
-        index_data = ((id(agent), agent.shape.bounds, None) for agent in agents)
+        index_data = ((id(agent), _bounds(agent), None) for agent in agents)
 
         self.idx = index.Index(index_data)
         self.idx.agents = {id(agent): agent for agent in agents}
+        self._static_tree = None
 
     def update_bbox(self, bbox=None):
         """Update bounding box of the GeoSpace."""
         if bbox:
             self.bbox = bbox
-        elif not self.agents:
+            return
+
+        all_bounds = []
+        if self.idx.agents:
+            all_bounds.append(self.idx.bounds)
+        if self.dynamic_idx.agents:
+            all_bounds.append(self.dynamic_idx.bounds)
+        all_bounds.extend(layer.bounds for layer in self.layers.values() if len(layer))
+        if not all_bounds:
             self.bbox = None
         else:
-            self.bbox = self.idx.bounds
+            self.bbox = [
+                min(b[0] for b in all_bounds),
+                min(b[1] for b in all_bounds),
+                max(b[2] for b in all_bounds),
+                max(b[3] for b in all_bounds),
+            ]
 
     @property
     def agents(self):
+        return list(self.idx.agents.values()) + list(self.dynamic_idx.agents.values())
+
+    @property
+    def static_agents(self):
+        """Agents in the static index, i.e. agents that do not move."""
         return list(self.idx.agents.values())
 
+    @property
+    def dynamic_agents(self):
+        """Agents added with `dynamic=True`."""
+        return list(self.dynamic_idx.agents.values())
+
+    def _to_wgs84(self, shapes):
+        """Transform shapes to WGS84 GeoJSON geometries, with one pyproj call for all points
+        and one for the coordinates of all other shapes."""
+        shapes = np.array(shapes, dtype=object)
+        geometries = np.empty(len(shapes), dtype=object)
+        is_point = shapely.get_type_id(shapes) == 0
+
+        if is_point.any():
+            xs, ys = self.Transformer.transform(
+                shapely.get_x(shapes[is_point]), shapely.get_y(shapes[is_point])
+            )
+            geometries[is_point] = [
+                {"type": "Point", "coordinates": (x, y)} for x, y in zip(xs.tolist(), ys.tolist())
+            ]
+        if not is_point.all():
+            def transform(coords):
+                return np.column_stack(self.Transformer.transform(coords[:, 0], coords[:, 1]))
+
+            transformed = shapely.transform(shapes[~is_point], transform)
+            geometries[~is_point] = [mapping(shape) for shape in transformed]
+        return geometries
+
+    def get_features(self, agents=None, properties=None):
+        """Return GeoJSON Features of agents, in WGS84.
+
+        All coordinates are transformed in bulk, and the geometries of static
+        agents are cached until their shape changes.
+
+        Args:
+            agents: List of agents to export. Omit to export all agents.
+            properties: Names of the agent attributes to export. Omit to
+                export all attributes, like GeoAgent.__geo_interface__.
+        """
+        if agents is None:
+            agents = self.agents
+
+        geometries = [None] * len(agents)
+        missing = []
+        for i, agent in enumerate(agents):
+            cached = self._geometry_cache.get(id(agent))
+            if cached is not None and cached[0] is agent.shape:
+                geometries[i] = cached[1]
+            else:
+                missing.append(i)
+        if missing:
+            shapes = [agents[i].shape for i in missing]
+            for i, shape, geometry in zip(missing, shapes, self._to_wgs84(shapes)):
+                geometries[i] = geometry
+                if id(agents[i]) in self.idx.agents:
+                    self._geometry_cache[id(agents[i])] = (shape, geometry)
+
+        features = []
+        for agent, geometry in zip(agents, geometries):
+            if properties is None:
+                agent_properties = attributes(agent)
+                agent_properties.pop("shape")
+                agent_properties["model"] = str(agent.model)
+            else:
+                agent_properties = {name: getattr(agent, name) for name in properties}
+            features.append({"type": "Feature", "geometry": geometry, "properties": agent_properties})
+        return features
+
+    def get_layer_features(self, name, properties=None):
+        """Return GeoJSON Features of the points of a layer, in WGS84.
+
+        Args:
+            name: Name of the layer
+            properties: Names of the columns to export. Omit to export all
+                columns.
+        """
+        return self.layers[name].get_features(self.Transformer, properties)
+
     @property
     def __geo_interface__(self):
         """Return a GeoJSON FeatureCollection."""
-        features = [a.__geo_interface__() for a in self.agents]
-        return {"type": "FeatureCollection", "features": features}
+        return {"type": "FeatureCollection", "features": self.get_features()}
@@ -0,0 +1,149 @@
+"""
+Read-only layer of static points for the mesa_geo framework.
+
+Core Objects: PointLayer
+
+"""
+import geopandas as gpd
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class PointLayer:
+    """Static points held as coordinate arrays, with attribute columns and a KD-tree.
+
+    A PointLayer stands in for many static point agents that never move and
+    never step, e.g. landmarks or route markers. Its points are referred to by
+    their index, 0 to len(layer) - 1, in every method and in every column.
+    Nearest and within-distance lookups are answered by a KD-tree, built once.
+
+    Properties:
+        x: Array of the x coordinates
+        y: Array of the y coordinates
+        ids: Unique id of every point
+        columns: Dictionary of attribute arrays, one value per point
+        tree: scipy cKDTree of the points
+    """
+
+    def __init__(self, x, y, ids=None, columns=None):
+        """Create a layer from coordinate arrays.
+
+        Args:
+            x: x coordinates of the points
+            y: y coordinates of the points
+            ids: Unique ids of the points. Omit to use their index.
+            columns: Dictionary of attribute arrays, one value per point
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        if self.x.shape != self.y.shape or self.x.ndim != 1:
+            raise ValueError("x and y must be one dimensional arrays of the same length")
+        self.ids = list(range(len(self.x))) if ids is None else list(ids)
+        self.columns = {}
+        for name, values in (columns or {}).items():
+            self.add_column(name, values)
+        self.tree = cKDTree(np.column_stack((self.x, self.y)))
+
+    @classmethod
+    def from_GeoDataFrame(cls, gdf, unique_id="index", crs="epsg:3857", set_attributes=True):
+        """Create a layer from a GeoDataFrame of points.
+
+        Args:
+            unique_id: Column to use for the ids of the points.
+                If "index" use the GeoDataFrame index
+            crs: Coordinate reference system to convert the points to
+            set_attributes: Keep the other columns as attribute columns
+        """
+        if unique_id != "index":
+            gdf = gdf.set_index(unique_id)
+        gdf = gdf.to_crs(crs)
+        columns = {}
+        if set_attributes:
+            columns = {name: gdf[name].to_numpy() for name in gdf.columns if name != gdf.geometry.name}
+        return cls(gdf.geometry.x.to_numpy(), gdf.geometry.y.to_numpy(), gdf.index.tolist(), columns)
+
+    @classmethod
+    def from_file(cls, filename, unique_id="index", crs="epsg:3857", set_attributes=True):
+        """Create a layer from a vector data file of points (e.g. GeoJSON).
+
+        Args:
+            filename: The filename of the vector data
+            unique_id: The field name of the data to use as the ids
+            crs: Coordinate reference system to convert the points to
+            set_attributes: Keep the other fields as attribute columns
+        """
+        return cls.from_GeoDataFrame(gpd.read_file(filename), unique_id, crs, set_attributes)
+
+    def __len__(self):
+        return len(self.x)
+
+    def __getitem__(self, name):
+        """Return the attribute column `name`."""
+        return self.columns[name]
+
+    @property
+    def bounds(self):
+        """Bounding box of the points, as (minx, miny, maxx, maxy)."""
+        return self.x.min(), self.y.min(), self.x.max(), self.y.max()
+
+    def add_column(self, name, values):
+        """Add or replace an attribute column, with one value per point."""
+        values = np.asarray(values)
+        if len(values) != len(self.x):
+            raise ValueError("Column {} must have one value per point".format(name))
+        self.columns[name] = values
+
+    def coords(self, i):
+        """Return the coordinates of point `i` as a tuple of floats."""
+        return float(self.x[i]), float(self.y[i])
+
+    def nearest(self, x, y, distance=np.inf):
+        """Return the closest point to each of one or many positions.
+
+        Args:
+            x: x coordinate, or array of x coordinates
+            y: y coordinate, or array of y coordinates
+            distance: Only points within this distance are returned
+
+        Returns:
+            Distance and index of the closest point, like `x` and `y`. The
+            index is -1, and the distance inf, where no point is within
+            `distance`.
+        """
+        # The bound of cKDTree is exclusive, points at exactly `distance` are returned too
+        found_distance, index = self.tree.query(np.stack((x, y), axis=-1),
+                                                distance_upper_bound=np.nextafter(distance, np.inf))
+        # cKDTree returns len(layer) for positions without a point in range
+        if np.ndim(index) == 0:
+            return (float(found_distance), int(index)) if index < len(self.x) else (np.inf, -1)
+        index = np.where(index < len(self.x), index, -1)
+        return found_distance, index
+
+    def within_distance(self, x, y, distance):
+        """Return the sorted indices of the points within `distance` of (x, y)."""
+        return np.array(sorted(self.tree.query_ball_point((x, y), distance)), dtype=np.intp)
+
+    def get_features(self, transformer=None, properties=None):
+        """Return GeoJSON Features of the points.
+
+        Args:
+            transformer: pyproj Transformer to convert the coordinates with,
+                e.g. the one of a GeoSpace. Omit to keep them as they are.
+            properties: Names of the columns to export. Omit to export all
+                columns.
+        """
+        x, y = self.x, self.y
+        if transformer is not None:
+            x, y = transformer.transform(x, y)
+        names = list(self.columns) if properties is None else properties
+        columns = [self.columns[name].tolist() for name in names]
+        features = []
+        for i, (point_x, point_y) in enumerate(zip(np.asarray(x).tolist(), np.asarray(y).tolist())):
+            point_properties = {name: column[i] for name, column in zip(names, columns)}
+            point_properties["unique_id"] = self.ids[i]
+            features.append({
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": (point_x, point_y)},
+                "properties": point_properties,
+            })
+        return features
@@ -1,14 +1,57 @@
-from mesa_geo.visualization.ModularVisualization import VisualizationElement
+import struct
+
+import numpy as np
+import shapely
+from shapely.geometry import Point
+
+from mesa_geo.geoagent import PointAgent
+from mesa_geo.visualization.ModularVisualization import BinaryState, VisualizationElement
 
 
 class MapModule(VisualizationElement):
-    """A MapModule for Leaflet maps."""
+    """A MapModule for Leaflet maps.
+
+    The static agents of the GeoSpace are sent once, in the first frame of a
+    model (after a connect or a reset). Every later frame only carries the
+    moving agents that were added, moved, changed their portrayal or were
+    removed since the previous frame. Agents given by `retired_method` left
+    the GeoSpace but stay on the map: they are drawn with the static agents,
+    and sent once, in the first frame after they retired.
+
+    Full frame:
+        {"full": true,
+         "static": FeatureCollection of the static and retired agents,
+         "dynamic": FeatureCollection of the moving agents, with feature ids}
+
+    Delta frame:
+        {"full": false,
+         "added": [Feature, ...],
+         "moved": [[id, lon, lat], ...],
+         "styled": [[id, portrayal], ...],
+         "removed": [id, ...],
+         "retired": [Feature, ...]}
+
+    With `binary=True`, frames after the first are a BinaryState. Its buffer
+    holds the position and style code of every moving agent, which must be
+    points, in the order of the last "order" list sent:
+        uint32 n, float32 lon[n], float32 lat[n], uint8 code[n]
+    all little-endian. Its JSON state only carries what the buffer cannot:
+        {"full": false, "binary": true,
+         "styles": {code: portrayal, ...} for new portrayals,
+         "order": [id, ...] and "added": [Feature, ...] when agents were
+         added, or only "removed": [id, ...] when agents were only removed,
+         "retired": [Feature, ...] for new retired agents}
+    """
 
     package_includes = ["leaflet.js", "LeafletMap.js"]
     local_includes = []
 
+    # Decimals of the coordinates of moved agents, 7 is about 1 cm
+    precision = 7
+
     def __init__(
-        self, portrayal_method, view=[0, 0], zoom=1, map_height=500, map_width=500
+        self, portrayal_method, view=[0, 0], zoom=1, map_height=500, map_width=500, binary=False,
+        properties=None, retired_method=None,
     ):
         self.portrayal_method = portrayal_method
         self.map_height = map_height
@@ -18,12 +61,166 @@ class MapModule(VisualizationElement):
         new_element = new_element.format(view, zoom, map_width, map_height)
         self.js_code = "elements.push(" + new_element + ");"
 
+        self.binary = binary
+        # Agent attributes sent with each feature, all of them if None
+        self.properties = properties
+        # Function of the model returning the agents that left the GeoSpace but stay on the map
+        self.retired_method = retired_method
+
+        self._model = None
+        self._sent = {}
+        self._order = []
+        self._styles = {}
+        self._retired = set()
+
     def render(self, model):
-        featurecollection = dict(type="FeatureCollection", features=[])
-        for _, agent in enumerate(model.grid.agents):
-            shape = agent.__geo_interface__()
+        if model is not self._model:
+            return self.render_full(model)
+        if self.binary:
+            return self.render_binary(model)
+        return self.render_delta(model)
+
+    def _features(self, model, agents, portrayals, with_ids=False):
+        features = model.grid.get_features(agents, self.properties)
+        for agent, feature, portrayal in zip(agents, features, portrayals):
+            feature["properties"].update(portrayal)
+            if with_ids:
+                feature["id"] = str(agent.unique_id)
+        return features
+
+    def _new_retired(self, model):
+        """Features of the retired agents that were not sent yet."""
+        if self.retired_method is None:
+            return []
+        retired = [agent for agent in self.retired_method(model) if id(agent) not in self._retired]
+        self._retired.update(id(agent) for agent in retired)
+        return self._features(model, retired, [self.portrayal_method(agent) for agent in retired])
+
+    @staticmethod
+    def _position(agent):
+        if isinstance(agent, PointAgent):
+            return agent.x, agent.y
+        if isinstance(agent.shape, Point):
+            return agent.shape.x, agent.shape.y
+        return agent.shape
+
+    def render_full(self, model):
+        """Frame with every agent, and the start of a new delta sequence."""
+        self._model = model
+        self._sent = {}
+        self._styles = {}
+        self._retired = set()
+        agents = model.grid.dynamic_agents
+        portrayals = [self.portrayal_method(agent) for agent in agents]
+        dynamic = self._features(model, agents, portrayals, with_ids=True)
+        for agent, feature, portrayal in zip(agents, dynamic, portrayals):
+            self._sent[id(agent)] = (feature["id"], self._position(agent), portrayal)
+        self._order = [feature["id"] for feature in dynamic]
+
+        static = model.grid.static_agents
+        static = self._features(model, static, [self.portrayal_method(agent) for agent in static])
+        static += self._new_retired(model)
+        return {
+            "full": True,
+            "static": dict(type="FeatureCollection", features=static),
+            "dynamic": dict(type="FeatureCollection", features=dynamic),
+        }
+
+    def render_delta(self, model):
+        """Frame with the moving agents that changed since the previous frame."""
+        added = []
+        added_portrayals = []
+        moved = []
+        styled = []
+        sent = {}
+        for agent in model.grid.dynamic_agents:
             portrayal = self.portrayal_method(agent)
-            for key, value in portrayal.items():
-                shape["properties"][key] = value
-                featurecollection["features"].append(shape)
-        return featurecollection
+            position = self._position(agent)
+            previous = self._sent.pop(id(agent), None)
+            # New agents, and moved agents that are not points, are sent whole
+            if previous is None or (not isinstance(position, tuple) and position is not previous[1]):
+                added.append(agent)
+                added_portrayals.append(portrayal)
+                sent[id(agent)] = (str(agent.unique_id), position, portrayal)
+                continue
+
+            feature_id, old_position, old_portrayal = previous
+            if position != old_position:
+                moved.append((feature_id, agent))
+            if portrayal != old_portrayal:
+                styled.append([feature_id, portrayal])
+            sent[id(agent)] = (feature_id, position, portrayal)
+
+        removed = [feature_id for feature_id, _, _ in self._sent.values()]
+        self._sent = sent
+        added = self._features(model, added, added_portrayals, with_ids=True)
+
+        moved_coords = []
+        if moved:
+            xs = np.array([self._position(agent)[0] for _, agent in moved])
+            ys = np.array([self._position(agent)[1] for _, agent in moved])
+            lons, lats = model.grid.Transformer.transform(xs, ys)
+            lons = np.round(lons, self.precision).tolist()
+            lats = np.round(lats, self.precision).tolist()
+            moved_coords = [[feature_id, lon, lat] for (feature_id, _), lon, lat in zip(moved, lons, lats)]
+
+        return {"full": False, "added": added, "moved": moved_coords, "styled": styled, "removed": removed,
+                "retired": self._new_retired(model)}
+
+    def _style_code(self, portrayal, new_styles):
+        key = tuple(sorted(portrayal.items()))
+        code = self._styles.get(key)
+        if code is None:
+            code = len(self._styles)
+            if code > 255:
+                raise ValueError("Binary map frames support at most 256 different portrayals")
+            self._styles[key] = code
+            new_styles[code] = portrayal
+        return code
+
+    def render_binary(self, model):
+        """Packed positions and style codes of all moving agents."""
+        agents = model.grid.dynamic_agents
+        state = {"full": False, "binary": True}
+
+        order = [str(agent.unique_id) for agent in agents]
+        if order != self._order:
+            current = set(order)
+            remaining = [feature_id for feature_id in self._order if feature_id in current]
+            if remaining == order:
+                # The client can drop the removed agents from its own order
+                state["removed"] = [feature_id for feature_id in self._order if feature_id not in current]
+            else:
+                known = set(self._order)
+                added = [agent for agent, feature_id in zip(agents, order) if feature_id not in known]
+                state["added"] = self._features(
+                    model, added, [self.portrayal_method(agent) for agent in added], with_ids=True
+                )
+                state["order"] = order
+            self._order = order
+        retired = self._new_retired(model)
+        if retired:
+            state["retired"] = retired
+
+        new_styles = {}
+        codes = np.fromiter(
+            (self._style_code(self.portrayal_method(agent), new_styles) for agent in agents),
+            dtype=np.uint8, count=len(agents),
+        )
+        if new_styles:
+            state["styles"] = new_styles
+
+        if all(isinstance(agent, PointAgent) for agent in agents):
+            xs = np.fromiter((agent.x for agent in agents), dtype=float, count=len(agents))
+            ys = np.fromiter((agent.y for agent in agents), dtype=float, count=len(agents))
+        else:
+            shapes = np.array([agent.shape for agent in agents], dtype=object)
+            xs, ys = shapely.get_x(shapes), shapely.get_y(shapes)
+        lons, lats = model.grid.Transformer.transform(xs, ys)
+        buffer = b"".join((
+            struct.pack("<I", len(agents)),
+            np.asarray(lons, dtype="<f4").tobytes(),
+            np.asarray(lats, dtype="<f4").tobytes(),
+            codes.tobytes(),
+        ))
+        return BinaryState(state, buffer)
@@ -22,10 +22,13 @@ VisualizationElement: Parent class for all other visualization elements, with
                       the minimal necessary options.
 PageHandler: The handler for the visualization page, generated from a template
              and built from the various visualization elements.
+ModelRunner: Steps a model on a background thread.
+Session: The model of one client, with its runner and visualization elements.
+SessionPool: Runs the sessions in a pool of worker processes.
 SocketHandler: Handles the websocket connection between the client page and
-                the server.
-ModularServer: The overall visualization application class which stores and
-               controls the model and visualization instance.
+                the server, i.e. one session.
+ModularServer: The overall visualization application class which holds the
+               sessions and the visualization instance.
 
 
 ModularServer should *not* need to be subclassed on a model-by-model basis; it
@@ -38,9 +41,11 @@ called canvasvis and graphvis; we would launch a server with:
     server = ModularServer(MyModel, [canvasvis, graphvis], name="My Model")
     server.launch()
 
-The client keeps track of what step it is showing. Clicking the Step button in
-the browser sends a message requesting the viz_state corresponding to the next
-step position, which is then sent back to the client via the websocket.
+Every client connection is a session with its own model, hosted in a pool of
+worker processes. The model is stepped by a ModelRunner on a background thread,
+independently of the browser. The client asks the runner to play, pause, or run to a given step
+or model time, and the server pushes the current viz_state to it at a fixed
+render rate, skipping frames while the previous one has not been sent yet.
 
 The websocket protocol is as follows:
 Each message is a JSON object, with a "type" property which defines the rest of
@@ -55,15 +60,26 @@ Server -> Client:
 
     {
     "type": "viz_state",
+    "step": number of steps run since the last reset,
     "data": [{0:[ {"Shape": "circle", "x": 0, "y": 0, "r": 0.5,
                 "Color": "#AAAAAA", "Filled": "true", "Layer": 0,
                 "text": 'A', "text_color": "white" }]},
             "Shape Count: 1"]
     }
 
+    Elements that render to a binary buffer (see BinaryState) send it first,
+    as a binary frame: a little-endian uint32 with the index of the element,
+    followed by the buffer. The JSON state of that element is then sent in the
+    "viz_state" message as usual, and the client hands both to its render
+    function.
+
     Informs the client that the model is over.
     {"type": "end"}
 
+    Informs the client of an error, e.g. that the server has reached its cap
+    on sessions, before closing the connection.
+    {"type": "error", "message": text}
+
     Informs the client of the current model's parameters
     {
     "type": "model_params",
@@ -77,12 +93,38 @@ Client -> Server:
     "type": "reset"
     }
 
-    Get a given state.
+    Run one more step.
     {
     "type": "get_step",
     "step:" index of the step to get.
     }
 
+    Run until paused, at a speed-up factor of model time over wall-clock
+    time, or as fast as possible if "speed" is omitted or null.
+    {
+    "type": "play",
+    "speed": speed-up factor
+    }
+
+    Stop running.
+    {
+    "type": "pause"
+    }
+
+    Run a number of steps.
+    {
+    "type": "run_steps",
+    "steps": number of steps to run,
+    "speed": speed-up factor, optional
+    }
+
+    Run until a model time.
+    {
+    "type": "run_to",
+    "time": "mm:ss" since the start of the model,
+    "speed": speed-up factor, optional
+    }
+
     Submit model parameter updates
     {
     "type": "submit_params",
@@ -96,7 +138,18 @@ Client -> Server:
     }
 
 """
+import asyncio
+import copy
+import itertools
+import math
+import multiprocessing
 import os
+import struct
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
 import tornado.autoreload
 import tornado.ioloop
 import tornado.web
@@ -149,6 +202,354 @@ class VisualizationElement:
         """
         return "<b>VisualizationElement goes here</b>."
 
+
+class BinaryState:
+    """
+    Visualization data of an element with a binary part.
+
+    Returned by `render` of elements that send bulk data as a binary
+    websocket frame, next to a small JSON-ready state.
+
+    Attributes:
+        state: A JSON-ready object, sent in the "viz_state" message.
+        buffer: A bytes-like object, sent as a binary frame.
+
+    """
+
+    def __init__(self, state, buffer):
+        self.state = state
+        self.buffer = buffer
+
+class ModelRunner:
+    """
+    Steps a model on a background thread, decoupled from rendering.
+
+    The runner steps the model while it has steps left to run: up to a target
+    step, or without limit while playing, and never past the end of the
+    model. With a speed-up factor, stepping is throttled to that many model
+    seconds per wall-clock second; otherwise it runs as fast as possible.
+    Renders take the model between two steps with `frame()`.
+
+    Attributes:
+        model: The model being run.
+        seconds_per_step: Model time of one step, in seconds.
+        steps: Number of steps run so far.
+        speed: Current speed-up factor, or None for full speed.
+
+    """
+
+    def __init__(self, model, seconds_per_step=1):
+        self.model = model
+        self.seconds_per_step = seconds_per_step
+        self.steps = 0
+        self.speed = None
+        self._target = 0  # Step to run up to, None to run until paused
+        self._clock = (time.monotonic(), 0)  # Wall-clock time and step the speed is measured from
+        self._frames = 0  # Number of renders waiting for the model
+        self._frames_lock = threading.Lock()
+        self._stopped = False
+        self._condition = threading.Condition()  # Guards the run state, not the model
+        self._model_lock = threading.Lock()  # Held while the model steps or is rendered
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        """ True while the runner has steps left to run. """
+        return self.model.running and (self._target is None or self.steps < self._target)
+
+    def _set_target(self, target, speed):
+        with self._condition:
+            self._target = target
+            self.speed = speed
+            self._clock = (time.monotonic(), self.steps)
+            self._condition.notify_all()
+
+    def play(self, speed=None):
+        """ Run until paused. """
+        self._set_target(None, speed)
+
+    def pause(self):
+        """ Stop after the current step. """
+        self._set_target(self.steps, self.speed)
+
+    def run_steps(self, steps, speed=None):
+        """ Run a number of steps. """
+        self._set_target(self.steps + steps, speed)
+
+    def run_to(self, seconds, speed=None):
+        """ Run until the model time, in seconds since the start, is reached. """
+        self._set_target(max(self.steps, math.ceil(seconds / self.seconds_per_step)), speed)
+
+    def stop(self):
+        """ Stop the background thread. """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    @contextmanager
+    def frame(self):
+        """ Hold the model between two steps, e.g. to render it. """
+        with self._frames_lock:
+            self._frames += 1
+        try:
+            with self._model_lock:
+                yield self.model
+        finally:
+            with self._frames_lock:
+                self._frames -= 1
+            with self._condition:
+                self._condition.notify_all()
+
+    def _delay(self):
+        """ Seconds to wait before the next step, to keep to the speed. """
+        if not self.speed:
+            return 0
+        start_time, start_step = self._clock
+        due = start_time + (self.steps + 1 - start_step) * self.seconds_per_step / self.speed
+        return due - time.monotonic()
+
+    def _wait_for_step(self):
+        """ Wait until the next step is due. Returns False once the runner is stopped. """
+        with self._condition:
+            while not self._stopped:
+                if not self.running or self._frames:
+                    self._condition.wait()
+                    continue
+                delay = self._delay()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                return True
+            return False
+
+    def _run(self):
+        # The run state is only locked between steps, so that commands and stop() are
+        # taken while the model steps, and applied before the next step
+        while self._wait_for_step():
+            with self._model_lock:
+                self.model.step()
+                self.steps += 1
+
+
+def parse_time(value):
+    """ Seconds in a "mm:ss" (or "hh:mm:ss") string, or a number of seconds. """
+    if isinstance(value, (int, float)):
+        return value
+    seconds = 0
+    for part in str(value).split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+class Session:
+    """
+    One client's model, with its runner and its own copy of the
+    visualization elements, so that elements can keep per-client state.
+
+    """
+
+    def __init__(self, model_cls, model_params, visualization_elements, seconds_per_step=1):
+        self.visualization_elements = copy.deepcopy(visualization_elements)
+        self.model = model_cls(**model_params)
+        self.runner = ModelRunner(self.model, seconds_per_step)
+
+    def command(self, msg):
+        """ Apply a run control message of the client. """
+        runner = self.runner
+        if msg["type"] == "get_step":
+            runner.run_steps(1)
+        elif msg["type"] == "play":
+            runner.play(msg.get("speed"))
+        elif msg["type"] == "pause":
+            runner.pause()
+        elif msg["type"] == "run_steps":
+            runner.run_steps(int(msg["steps"]), msg.get("speed"))
+        elif msg["type"] == "run_to":
+            runner.run_to(parse_time(msg["time"]), msg.get("speed"))
+
+    def render(self, last_step=None):
+        """ Render the model, unless it is still at `last_step`.
+
+        Returns:
+            None if nothing changed, else a dictionary with the step, whether
+            the model is still running, the list of JSON-ready element states
+            and the binary buffers of the elements that have one, by index.
+
+        """
+        with self.runner.frame():
+            step = self.runner.steps
+            if step == last_step:
+                return None
+            visualization_state = []
+            buffers = {}
+            for index, element in enumerate(self.visualization_elements):
+                element_state = element.render(self.model)
+                if isinstance(element_state, BinaryState):
+                    buffers[index] = bytes(element_state.buffer)
+                    element_state = element_state.state
+                visualization_state.append(element_state)
+            return {"step": step, "running": self.model.running,
+                    "state": visualization_state, "buffers": buffers}
+
+    def close(self):
+        self.runner.stop()
+
+
+def _call_session(sessions, session_args, session_id, method, args):
+    """ Run a request on the sessions of a worker. """
+    if method == "open":
+        if session_id in sessions:
+            sessions.pop(session_id).close()
+        sessions[session_id] = Session(session_args[0], args[0], *session_args[1:])
+        return None
+    if method == "close":
+        if session_id in sessions:
+            sessions.pop(session_id).close()
+        return None
+    return getattr(sessions[session_id], method)(*args)
+
+
+def _serve_sessions(conn, session_args):
+    """ Main loop of a worker process: answer requests until the pipe closes. """
+    sessions = {}
+    while True:
+        try:
+            request = conn.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        request_id, session_id, method, args = request
+        try:
+            reply = (request_id, True, _call_session(sessions, session_args, session_id, method, args))
+        except Exception:
+            reply = (request_id, False, traceback.format_exc())
+        conn.send(reply)
+    for session in sessions.values():
+        session.close()
+
+
+class _LocalWorker:
+    """ Hosts sessions in the server process. """
+
+    def __init__(self, session_args):
+        self.session_args = session_args
+        self.sessions = {}
+
+    def submit(self, session_id, method, args):
+        future = asyncio.get_running_loop().create_future()
+        try:
+            future.set_result(_call_session(self.sessions, self.session_args, session_id, method, args))
+        except Exception:
+            future.set_exception(RuntimeError(traceback.format_exc()))
+        return future
+
+    def close(self):
+        for session in self.sessions.values():
+            session.close()
+        self.sessions = {}
+
+
+class _ProcessWorker:
+    """ Hosts sessions in a worker process, and resolves the replies on the event loop. """
+
+    def __init__(self, context, session_args):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_serve_sessions, args=(child_conn, session_args), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.futures = {}
+        self.request_ids = itertools.count()
+        self.loop = None
+        self.reader = None
+
+    def start_reader(self):
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def _read(self):
+        while True:
+            try:
+                request_id, ok, result = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self.loop.call_soon_threadsafe(self._resolve, request_id, ok, result)
+
+    def _resolve(self, request_id, ok, result):
+        future = self.futures.pop(request_id)
+        if future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    def submit(self, session_id, method, args):
+        self.loop = asyncio.get_running_loop()
+        request_id = next(self.request_ids)
+        future = self.loop.create_future()
+        self.futures[request_id] = future
+        self.conn.send((request_id, session_id, method, args))
+        return future
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        self.conn.close()
+
+
+class SessionPool:
+    """
+    Runs the sessions of the server in a fixed number of worker processes,
+    so that the models of different clients step in parallel. Each session
+    stays in the worker it was opened in.
+
+    With `processes=0` the sessions are hosted in the server process instead.
+
+    """
+
+    def __init__(self, model_cls, visualization_elements, processes=None, seconds_per_step=1):
+        session_args = (model_cls, visualization_elements, seconds_per_step)
+        if processes == 0:
+            self.workers = [_LocalWorker(session_args)]
+        else:
+            context = multiprocessing.get_context()
+            self.workers = [_ProcessWorker(context, session_args)
+                            for _ in range(processes or os.cpu_count() or 1)]
+            # Readers are threads, started once all workers have been forked
+            for worker in self.workers:
+                worker.start_reader()
+        self.assigned = {}
+
+    def call(self, session_id, method, *args):
+        """ Call a Session method of a session; returns a future of the result. """
+        return self.assigned[session_id].submit(session_id, method, args)
+
+    def open(self, session_id, model_params):
+        """ Create the model of a session, or replace it. """
+        if session_id not in self.assigned:
+            load = {id(worker): 0 for worker in self.workers}
+            for worker in self.assigned.values():
+                load[id(worker)] += 1
+            self.assigned[session_id] = min(self.workers, key=lambda worker: load[id(worker)])
+        return self.call(session_id, "open", model_params)
+
+    def close(self, session_id):
+        """ Stop and drop the model of a session. """
+        if session_id in self.assigned:
+            self.call(session_id, "close")
+            del self.assigned[session_id]
+
+    def shutdown(self):
+        for worker in self.workers:
+            worker.close()
+
+
 # =============================================================================
 # Actual Tornado code starts here:
 
@@ -169,55 +570,138 @@ class PageHandler(tornado.web.RequestHandler):
 
 
 class SocketHandler(tornado.websocket.WebSocketHandler):
-    """ Handler for websocket. """
+    """ Handler for websocket. Each connection is a session with its own model. """
     def open(self):
         if self.application.verbose:
             print("Socket opened!")
+        self.session_id = None
+        if not self.application.add_session(self):
+            self.write_message({"type": "error", "message": "Too many sessions, try again later."})
+            self.close(1013, "Too many sessions")
+            return
+        self.model_kwargs = copy.deepcopy(self.application.model_kwargs)
+        self.has_model = False
+        self.model_running = False
+        self.rendered_step = None
+        self.ended = False
+        self.rendering = False
+        self.pending_write = None
+        self.last_active = time.monotonic()
+        self.render_loop = tornado.ioloop.PeriodicCallback(
+            self.push_frame, 1000 / self.application.render_fps)
+        self.render_loop.start()
+
+    def on_close(self):
+        if self.session_id is None:
+            return
+        self.render_loop.stop()
+        self.application.remove_session(self)
 
     def check_origin(self, origin):
         return True
 
+    def get_compression_options(self):
+        # permessage-deflate with the default options, if enabled
+        return {} if self.application.compress_websocket else None
+
     @property
-    def viz_state_message(self):
-        return {
-            "type": "viz_state",
-            "data": self.application.render_model()
-        }
+    def user_params(self):
+        result = {}
+        for param, val in self.model_kwargs.items():
+            if isinstance(val, UserSettableParameter):
+                result[param] = val.json
+
+        return result
 
-    def on_message(self, message):
+    @property
+    def model_params(self):
+        """ Values of the current model parameters of the session. """
+        model_params = {}
+        for key, val in self.model_kwargs.items():
+            if isinstance(val, UserSettableParameter):
+                if val.param_type == 'static_text':    # static_text is never used for setting params
+                    continue
+                model_params[key] = val.value
+            else:
+                model_params[key] = val
+        return model_params
+
+    async def push_frame(self):
+        """ Send the current state if it changed, unless the previous frame is still being sent. """
+        if not self.has_model or self.rendering:
+            return
+        if self.pending_write is not None and not self.pending_write.done():
+            return
+        self.rendering = True
+        try:
+            frame = await self.application.pool.call(self.session_id, "render", self.rendered_step)
+        except RuntimeError:
+            if self.ws_connection is None:
+                return  # The session was closed while rendering
+            raise
+        finally:
+            self.rendering = False
+        if self.ws_connection is None:
+            return
+        if frame is not None:
+            self.write_frame(frame)
+        elif not self.ended and self.rendered_step is not None and not self.model_running:
+            self.ended = True
+            self.pending_write = self.write_message({"type": "end"})
+
+    def write_frame(self, frame):
+        """ Send the binary frames of the elements, then the viz_state message. """
+        self.rendered_step = frame["step"]
+        self.model_running = frame["running"]
+        self.last_active = time.monotonic()
+        for index, buffer in frame["buffers"].items():
+            self.write_message(struct.pack("<I", index) + buffer, binary=True)
+        self.pending_write = self.write_message(
+            {"type": "viz_state", "step": frame["step"], "data": frame["state"]})
+
+    async def on_message(self, message):
         """ Receiving a message from the websocket, parse, and act accordingly.
 
         """
         if self.application.verbose:
             print(message)
         msg = tornado.escape.json_decode(message)
+        self.last_active = time.monotonic()
+        pool = self.application.pool
 
-        if msg["type"] == "get_step":
-            if not self.application.model.running:
+        if msg["type"] in ("get_step", "play", "pause", "run_steps", "run_to"):
+            if not self.has_model:
+                return
+            if msg["type"] == "get_step" and not self.model_running:
                 self.write_message({"type": "end"})
             else:
-                self.application.model.step()
-                self.write_message(self.viz_state_message)
+                await pool.call(self.session_id, "command", msg)
 
         elif msg["type"] == "reset":
-            self.application.reset_model()
-            self.write_message(self.viz_state_message)
+            self.has_model = False
+            self.rendered_step = None
+            self.ended = False
+            await pool.open(self.session_id, self.model_params)
+            self.has_model = True
+            frame = await pool.call(self.session_id, "render")
+            if self.ws_connection is not None:
+                self.write_frame(frame)
 
         elif msg["type"] == "submit_params":
             param = msg["param"]
             value = msg["value"]
 
             # Is the param editable?
-            if param in self.application.user_params:
-                if isinstance(self.application.model_kwargs[param], UserSettableParameter):
-                    self.application.model_kwargs[param].value = value
+            if param in self.user_params:
+                if isinstance(self.model_kwargs[param], UserSettableParameter):
+                    self.model_kwargs[param].value = value
                 else:
-                    self.application.model_kwargs[param] = value
+                    self.model_kwargs[param] = value
 
         elif msg["type"] == "get_params":
             self.write_message({
                 "type": "model_params",
-                "params": self.application.user_params
+                "params": self.user_params
             })
 
         else:
@@ -226,11 +710,23 @@ class SocketHandler(tornado.websocket.WebSocketHandler):
 
 
 class ModularServer(tornado.web.Application):
-    """ Main visualization application. """
+    """ Main visualization application.
+
+    Every websocket connection gets its own model, run in a pool of
+    `processes` worker processes (all cores if None, the server process if
+    0). At most `max_sessions` models exist at a time, and sessions without
+    client messages or new frames for `session_timeout` seconds are closed.
+    """
     verbose = True
 
     port = 8521  # Default port to listen on
     max_steps = 100000
+    compress_websocket = False  # Enable permessage-deflate on the websocket
+    render_fps = 10  # Frames pushed to the client per second, at most
+    seconds_per_step = 1  # Model time of one step, for "run_to"
+    processes = None  # Worker processes of the session pool
+    max_sessions = 8  # Models that may exist at the same time
+    session_timeout = 600  # Seconds of inactivity after which a session is closed
 
     # Handlers and other globals:
     page_handler = (r'/', PageHandler)
@@ -273,44 +769,36 @@ class ModularServer(tornado.web.Application):
             self.description = model_cls.__doc__
 
         self.model_kwargs = model_params
-        self.reset_model()
+        self.sessions = {}
+        self.session_ids = itertools.count()
+        self.pool = SessionPool(self.model_cls, self.visualization_elements,
+                                self.processes, self.seconds_per_step)
 
         # Initializing the application itself:
         super().__init__(self.handlers, **self.settings)
 
-    @property
-    def user_params(self):
-        result = {}
-        for param, val in self.model_kwargs.items():
-            if isinstance(val, UserSettableParameter):
-                result[param] = val.json
-
-        return result
-
-    def reset_model(self):
-        """ Reinstantiate the model object, using the current parameters. """
-
-        model_params = {}
-        for key, val in self.model_kwargs.items():
-            if isinstance(val, UserSettableParameter):
-                if val.param_type == 'static_text':    # static_text is never used for setting params
-                    continue
-                model_params[key] = val.value
-            else:
-                model_params[key] = val
-
-        self.model = self.model_cls(**model_params)
-
-    def render_model(self):
-        """ Turn the current state of the model into a dictionary of
-        visualizations
+    def add_session(self, handler):
+        """ Register a new websocket session, if the cap allows it. """
+        if len(self.sessions) >= self.max_sessions:
+            return False
+        handler.session_id = next(self.session_ids)
+        self.sessions[handler.session_id] = handler
+        return True
 
-        """
-        visualization_state = []
-        for element in self.visualization_elements:
-            element_state = element.render(self.model)
-            visualization_state.append(element_state)
-        return visualization_state
+    def remove_session(self, handler):
+        """ Drop a websocket session and its model. """
+        self.sessions.pop(handler.session_id, None)
+        self.pool.close(handler.session_id)
+
+    def evict_idle_sessions(self):
+        """ Close the sessions that have been inactive for `session_timeout` seconds. """
+        now = time.monotonic()
+        for handler in list(self.sessions.values()):
+            if now - handler.last_active > self.session_timeout:
+                if self.verbose:
+                    print("Closing idle session {}".format(handler.session_id))
+                handler.close(1000, "Session closed after inactivity")
+                self.remove_session(handler)
 
     def launch(self, port=None, open_browser=True):
         """ Run the app. """
@@ -321,5 +809,6 @@ class ModularServer(tornado.web.Application):
         self.listen(self.port)
         if open_browser:
             webbrowser.open(url)
+        tornado.ioloop.PeriodicCallback(self.evict_idle_sessions, 10000).start()
         tornado.autoreload.start()
         tornado.ioloop.IOLoop.current().start()
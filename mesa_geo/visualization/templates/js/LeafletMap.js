@@ -5,9 +5,14 @@ var MapModule = function (view, zoom, map_width, map_height) {
   var div = $(map_tag)[0]
   $('#elements').append(div)
 
-  // Create Leaflet map and Agent layers
-  var Lmap = L.map('mapid').setView(view, zoom)
-  var AgentLayer = L.geoJSON().addTo(Lmap)
+  // Create Leaflet map and Agent layers, drawn on a canvas to keep many markers fast
+  var Lmap = L.map('mapid', { preferCanvas: true }).setView(view, zoom)
+  var StaticLayer = L.geoJSON().addTo(Lmap)
+  var DynamicLayer = L.layerGroup().addTo(Lmap)
+  var dynamicAgents = {}
+  var order = []
+  var codes = {}
+  var styles = {}
 
   // create the OSM tile layer with correct attribution
   var osmUrl = 'http://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png'
@@ -15,21 +20,116 @@ var MapModule = function (view, zoom, map_width, map_height) {
   var osm = new L.TileLayer(osmUrl, { minZoom: 0, maxZoom: 18, attribution: osmAttrib })
   Lmap.addLayer(osm)
 
-  this.render = function (data) {
-    AgentLayer.remove()
-    AgentLayer = L.geoJSON(data, {
-      onEachFeature: PopUpProperties,
-      style: function (feature) {
-        return { color: feature.properties.color };
-      },
-      pointToLayer: function (feature, latlang) {
-        return L.circleMarker(latlang, { radius: feature.properties.radius, color: feature.properties.color });
+  var geoJSONOptions = {
+    onEachFeature: PopUpProperties,
+    style: function (feature) {
+      return { color: feature.properties.color };
+    },
+    pointToLayer: function (feature, latlang) {
+      return L.circleMarker(latlang, { radius: feature.properties.radius, color: feature.properties.color });
+    }
+  }
+
+  var addAgent = function (feature) {
+    removeAgent(feature.id)
+    var layer = L.geoJSON(feature, geoJSONOptions)
+    dynamicAgents[feature.id] = layer
+    DynamicLayer.addLayer(layer)
+  }
+
+  var removeAgent = function (id) {
+    if (id in dynamicAgents) {
+      DynamicLayer.removeLayer(dynamicAgents[id])
+      delete dynamicAgents[id]
+    }
+  }
+
+  var moveAgent = function (id, lon, lat) {
+    dynamicAgents[id].eachLayer(function (layer) {
+      layer.setLatLng([lat, lon])
+    })
+  }
+
+  var styleAgent = function (id, portrayal) {
+    dynamicAgents[id].eachLayer(function (layer) {
+      for (var key in portrayal) {
+        layer.feature.properties[key] = portrayal[key]
+      }
+      if ('color' in portrayal) layer.setStyle({ color: portrayal.color })
+      if ('radius' in portrayal && layer.setRadius) layer.setRadius(portrayal.radius)
+      PopUpProperties(layer.feature, layer)
+    })
+  }
+
+  var renderBinary = function (data, buffer) {
+    for (var code in data.styles) {
+      styles[code] = data.styles[code]
+    }
+    if (data.order) {
+      var keep = {}
+      data.order.forEach(function (id) { keep[id] = true })
+      for (var id in dynamicAgents) {
+        if (!(id in keep)) removeAgent(id)
+      }
+      data.added.forEach(addAgent)
+      order = data.order
+    } else if (data.removed) {
+      var removed = {}
+      data.removed.forEach(function (id) {
+        removeAgent(id)
+        delete codes[id]
+        removed[id] = true
+      })
+      order = order.filter(function (id) { return !(id in removed) })
+    }
+    if (data.retired) StaticLayer.addData(data.retired)
+
+    // Buffer: uint32 element index, uint32 n, float32 lon[n], float32 lat[n], uint8 code[n], little-endian
+    // Typed arrays use the byte order of the host, which is little-endian on all common platforms
+    var n = new DataView(buffer).getUint32(4, true)
+    var lons = new Float32Array(buffer, 8, n)
+    var lats = new Float32Array(buffer, 8 + 4 * n, n)
+    var agentCodes = new Uint8Array(buffer, 8 + 8 * n, n)
+    for (var i = 0; i < n; i++) {
+      var id = order[i]
+      moveAgent(id, lons[i], lats[i])
+      if (codes[id] !== agentCodes[i]) {
+        codes[id] = agentCodes[i]
+        styleAgent(id, styles[agentCodes[i]])
       }
-    }).addTo(Lmap)
+    }
+  }
+
+  this.render = function (data, buffer) {
+    if (data.full) {
+      this.reset()
+      StaticLayer = L.geoJSON(data.static, geoJSONOptions).addTo(Lmap)
+      data.dynamic.features.forEach(addAgent)
+      order = data.dynamic.features.map(function (feature) { return feature.id })
+      return
+    }
+    if (data.binary) {
+      renderBinary(data, buffer)
+      return
+    }
+    data.removed.forEach(removeAgent)
+    data.added.forEach(addAgent)
+    data.moved.forEach(function (move) {
+      moveAgent(move[0], move[1], move[2])
+    })
+    data.styled.forEach(function (style) {
+      styleAgent(style[0], style[1])
+    })
+    StaticLayer.addData(data.retired)
   }
 
   this.reset = function () {
-    AgentLayer.remove()
+    StaticLayer.remove()
+    DynamicLayer.clearLayers()
+    dynamicAgents = {}
+    order = []
+    codes = {}
+    styles = {}
   }
 }
 
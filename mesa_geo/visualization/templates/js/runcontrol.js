@@ -1,8 +1,8 @@
 /** runcontrol.js
 
- Users can reset() the model, advance it by one step(), or run() it through. reset() and
- step() send a message to the server, which then sends back the appropriate data. run() just
- calls the step() method at fixed intervals.
+ Users can reset() the model, advance it by one step(), run() it through, or run it to a
+ model time or by a number of steps. The model runs on the server, which pushes the current
+ state at its own render rate; these functions only send commands.
 
  The model parameters are controlled via the MesaVisualizationControl object.
  */
@@ -12,16 +12,15 @@
  *
  * tick: What tick of the model we're currently at
  running: Boolean on whether we have reached the end of the current model
- * fps: Current frames per second.
+ * speed: Speed-up factor of model time over wall-clock time, 0 for as fast as possible.
  */
 var MesaVisualizationControl = function() {
     this.tick = -1; // Counts at which tick of the model we are.
     this.running = false; // Whether there is currently a model running
     this.done = false;
-    this.fps = 3; // Frames per second
+    this.speed = 1; // Speed-up factor
 };
 
-var player; // Variable to store the continuous player
 var control = new MesaVisualizationControl();
 var elements = [];  // List of Element objects
 var model_params = {};
@@ -30,14 +29,18 @@ var model_params = {};
 var playPauseButton = $('#play-pause');
 var stepButton = $('#step');
 var resetButton = $('#reset');
-var fpsControl = $('#fps').slider({
-    max: 20,
+var speedControl = $('#speed').slider({
+    max: 100,
     min: 0,
-    value: 3,
-    ticks: [0, 20],
-    ticks_labels: [0, 20],
+    value: 1,
+    ticks: [0, 100],
+    ticks_labels: ["max", 100],
     ticks_position: [0, 100]
 });
+var runToButton = $('#run-to');
+var runToInput = $('#run-to-time');
+var runStepsButton = $('#run-steps');
+var runStepsInput = $('#run-steps-count');
 
 // Sidebar dom access
 var sidebar = $("#sidebar");
@@ -45,6 +48,10 @@ var sidebar = $("#sidebar");
 // WebSocket Stuff
 // Open the websocket connection; support TLS-specific URLs when appropriate
 var ws = new WebSocket((window.location.protocol === "https:" ? "wss://" : "ws://") + location.host + "/ws");
+ws.binaryType = "arraybuffer";
+
+// Binary frames of the elements, by element index, until the viz_state message that follows them
+var pendingBuffers = {};
 
 ws.onopen = function() {
     console.log("Connection opened!");
@@ -215,22 +222,34 @@ var initGUI = function() {
 
 /** Parse and handle an incoming message on the WebSocket connection. */
 ws.onmessage = function(message) {
+    if (message.data instanceof ArrayBuffer) {
+        // Little-endian uint32 element index, followed by the element's buffer
+        var index = new DataView(message.data).getUint32(0, true);
+        pendingBuffers[index] = message.data;
+        return;
+    }
     var msg = JSON.parse(message.data);
     switch (msg["type"]) {
         case "viz_state":
+            control.tick = msg["step"];
             var data = msg["data"];
             for (var i in elements) {
-                elements[i].render(data[i]);
+                elements[i].render(data[i], pendingBuffers[i]);
             }
+            pendingBuffers = {};
             break;
         case "end":
             // We have reached the end of the model
             control.running = false;
             control.done = true;
             console.log("Done!");
-            clearInterval(player);
             $(playPauseButton.children()[0]).text("Done");
             break;
+        case "error":
+            // E.g. the server has no room for another session
+            console.log(msg["message"]);
+            alert(msg["message"]);
+            break;
         case "model_params":
             console.log(msg["params"]);
             model_params = msg["params"];
@@ -257,15 +276,20 @@ var reset = function() {
     for (var i in elements) {
         elements[i].reset();
     }
+    // The new model on the server starts paused
     control.done = false;
-    if (!control.running)
-        $(playPauseButton.children()[0]).text("Start");
+    control.running = false;
+    $(playPauseButton.children()[0]).text("Start");
+};
+
+/** Speed-up factor to send to the server, null for as fast as possible. */
+var speed = function() {
+    return control.speed > 0 ? control.speed : null;
 };
 
-/** Send a message to the server get the next visualization state. */
+/** Ask the server to run one more step. */
 var single_step = function() {
-    control.tick += 1;
-    send({"type": "get_step", "step": control.tick});
+    send({"type": "get_step", "step": control.tick + 1});
 };
 
 /** Step the model forward. */
@@ -274,29 +298,35 @@ var step = function() {
     else if (!control.done) {run()};
 };
 
-/** Call the step function at fixed intervals, until getting an end message from the server. */
+/** Run the model on the server until it is paused or reaches its end. */
 var run = function() {
     var anchor = $(playPauseButton.children()[0]);
     if (control.running) {
         control.running = false;
-        if (player) {
-            clearInterval(player);
-            player = null;
-        }
+        send({"type": "pause"});
         anchor.text("Start");
     }
     else if (!control.done) {
         control.running = true;
-        player = setInterval(single_step, 1000/control.fps);
+        send({"type": "play", "speed": speed()});
         anchor.text("Stop");
     }
 };
 
-var updateFPS = function() {
-    control.fps = Number(fpsControl.val());
+/** Run the model to a model time, given as mm:ss. */
+var runTo = function() {
+    send({"type": "run_to", "time": runToInput.val(), "speed": speed()});
+};
+
+/** Run the model by a number of steps. */
+var runSteps = function() {
+    send({"type": "run_steps", "steps": Number(runStepsInput.val()), "speed": speed()});
+};
+
+var updateSpeed = function() {
+    control.speed = Number(speedControl.val());
     if (control.running) {
-        run();
-        run();
+        send({"type": "play", "speed": speed()});
     }
 };
 
@@ -304,4 +334,6 @@ var updateFPS = function() {
 playPauseButton.on('click', run);
 stepButton.on('click', step);
 resetButton.on('click', reset);
-fpsControl.on('change', updateFPS);
+speedControl.on('change', updateSpeed);
+runToButton.on('click', runTo);
+runStepsButton.on('click', runSteps);
@@ -0,0 +1,70 @@
+import random
+
+import numpy as np
+import pytest
+
+from tsunami_model.checkpoint import Checkpoint
+from tsunami_model.model import TsunamiModel
+
+BEFORE = 100
+AFTER = 150
+
+
+def assert_same_run(model, restored):
+    np.testing.assert_array_equal(model.counts.series[:model.counts.steps_recorded],
+                                  restored.counts.series[:restored.counts.steps_recorded])
+    for a, b in zip(model.person_arrays(), restored.person_arrays()):
+        np.testing.assert_array_equal(a, b)
+    assert (model.steps, model.minute, model.second) == (restored.steps, restored.minute, restored.second)
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"engine": "agents"},
+    {"engine": "agents", "spatial_index": "rtree", "departure_delay": (30, 20)},
+    {"engine": "vectorized", "interaction": "density"},
+])
+def test_restored_model_continues_identically(kwargs):
+    model = TsunamiModel(150, 30, seed=3, records_file=None, **kwargs)
+    for _ in range(BEFORE):
+        model.step()
+    checkpoint = Checkpoint.from_bytes(model.checkpoint().to_bytes())
+    for _ in range(AFTER):
+        model.step()
+
+    restored = TsunamiModel.restore(checkpoint)
+    for _ in range(AFTER):
+        restored.step()
+    assert_same_run(model, restored)
+    if kwargs["engine"] == "agents":
+        for a, b in zip(model.agents_list, restored.agents_list):
+            assert (a.unique_id, a.x, a.y, a.state, a.target_marker, a.second_target_marker) == \
+                   (b.unique_id, b.x, b.y, b.state, b.target_marker, b.second_target_marker)
+
+
+def test_models_keep_their_own_generators():
+    alone = TsunamiModel(150, 30, seed=3, records_file=None, departure_delay=(30, 20))
+    for _ in range(BEFORE):
+        alone.step()
+
+    global_states = random.getstate(), np.random.get_state()[1].copy()
+    model = TsunamiModel(150, 30, seed=3, records_file=None, departure_delay=(30, 20))
+    other = TsunamiModel(150, 30, seed=4, records_file=None, departure_delay=(30, 20))
+    for _ in range(BEFORE // 2):
+        model.step()
+        other.step()
+    # A restored model draws from its own generators too
+    restored = TsunamiModel.restore(other.checkpoint())
+    for _ in range(BEFORE // 2):
+        model.step()
+        restored.step()
+    assert_same_run(alone, model)
+    assert random.getstate() == global_states[0]
+    np.testing.assert_array_equal(np.random.get_state()[1], global_states[1])
+
+
+def test_checkpoint_rejects_other_versions():
+    model = TsunamiModel(10, 2, seed=3, records_file=None)
+    checkpoint = model.checkpoint()
+    checkpoint.meta["version"] = -1
+    with pytest.raises(ValueError):
+        Checkpoint.from_bytes(checkpoint.to_bytes())
@@ -0,0 +1,29 @@
+import json
+from types import SimpleNamespace
+
+from mesa.visualization.modules import ChartModule
+
+from tsunami_model.counters import StateCounter
+
+STATES = ("susceptible", "safe")
+
+
+def test_transitions_are_recorded():
+    counts = StateCounter(STATES, 2)
+    counts.add("susceptible", 3)
+    counts.record(0)
+    counts.transition("susceptible", "safe")
+    counts.record(1)
+    counts.transitions([0, 0], [1, 1])
+    counts.record(2)
+    assert counts.as_dict() == {"susceptible": 0, "safe": 3}
+    assert counts.to_frame().values.tolist() == [[3, 0], [2, 1], [0, 3]]
+    assert counts.model_vars == {"susceptible": [3, 2, 0], "safe": [0, 1, 3]}
+
+
+def test_chart_state_is_json():
+    counts = StateCounter(STATES, 10)
+    counts.add("susceptible", 2)
+    counts.record(0)
+    chart = ChartModule([{"Label": state, "Color": "Red"} for state in STATES], data_collector_name="counts")
+    assert json.loads(json.dumps(chart.render(SimpleNamespace(counts=counts)))) == [2, 0]
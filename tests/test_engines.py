@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from tsunami_model.model import TsunamiModel
+
+STEPS = 300
+
+
+def run(engine, **kwargs):
+    model = TsunamiModel(150, 30, engine=engine, seed=7, records_file=None, **kwargs)
+    for _ in range(STEPS):
+        model.step()
+    return model
+
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"spatial_index": "rtree"},
+    {"departure_delay": (30, 20)},
+])
+def test_engines_give_the_same_counts(kwargs):
+    agents = run("agents", **kwargs)
+    vectorized = run("vectorized", **kwargs)
+    np.testing.assert_array_equal(agents.counts.series[:STEPS + 1], vectorized.counts.series[:STEPS + 1])
+    # Persons changed state during the run, so the comparison covers the transitions
+    assert agents.counts["off_beach"] > 0
+
+
+def test_engines_give_the_same_persons():
+    agents = run("agents")
+    vectorized = run("vectorized")
+    for a, b in zip(agents.person_arrays(), vectorized.person_arrays()):
+        np.testing.assert_array_equal(a, b)
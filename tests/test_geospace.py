@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from mesa import Model
+from shapely.geometry import Point, box
+
+from mesa_geo.geoagent import GeoAgent, PointAgent
+from mesa_geo.geospace import GeoSpace
+
+DISTANCE = 4.0
+
+
+def moved_spaces(seed=0, n=300, moves=5):
+    """A loose R-tree space and a hash space with the same point agents, moved at random."""
+    rng = np.random.default_rng(seed)
+    model = Model()
+    spaces = [GeoSpace(slack=2.5, dynamic_index="rtree"), GeoSpace(dynamic_index="hash", cell_size=5.0)]
+    xy = rng.uniform(0, 100, (n, 2))
+    agents = [[PointAgent(i, model, Point(x, y)) for i, (x, y) in enumerate(xy.tolist())] for _ in spaces]
+    for space, space_agents in zip(spaces, agents):
+        space.add_agents(space_agents, dynamic=True)
+    for _ in range(moves):
+        xy += rng.normal(0, 2, xy.shape)
+        for space, space_agents in zip(spaces, agents):
+            for agent, (x, y) in zip(space_agents, xy.tolist()):
+                space.move_point(agent, x, y)
+        # Queries interleave with moves, so that the loose R-tree is reloaded more than once
+        yield spaces, agents, xy
+
+
+def ids(agents):
+    return sorted(agent.unique_id for agent in agents)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_backends_find_the_same_intersecting_agents(seed):
+    rng = np.random.default_rng(seed + 10)
+    model = Model()
+    for (rtree, hashed), _, xy in moved_spaces(seed):
+        for _ in range(20):
+            x, y = rng.uniform(0, 100, 2)
+            query = GeoAgent(-1, model, box(x, y, x + rng.uniform(1, 20), y + rng.uniform(1, 20)))
+            expected = sorted(np.flatnonzero(
+                (xy[:, 0] >= query.shape.bounds[0]) & (xy[:, 0] <= query.shape.bounds[2])
+                & (xy[:, 1] >= query.shape.bounds[1]) & (xy[:, 1] <= query.shape.bounds[3])).tolist())
+            assert ids(rtree.get_intersecting_agents(query)) == expected
+            assert ids(hashed.get_intersecting_agents(query)) == expected
+
+
+def test_backends_find_the_same_neighbors_within_distance():
+    for (rtree, hashed), (rtree_agents, hashed_agents), xy in moved_spaces():
+        for i in range(0, len(xy), 15):
+            distance = np.hypot(*(xy - xy[i]).T)
+            # The buffer of the R-tree query is a polygon, points right at the distance may fall outside it
+            edge = set(np.flatnonzero((distance > 0.99 * DISTANCE) & (distance <= DISTANCE)).tolist())
+            found_rtree = set(ids(rtree.get_neighbors_within_distance(rtree_agents[i], DISTANCE))) - edge
+            found_hash = set(ids(hashed.get_neighbors_within_distance(hashed_agents[i], DISTANCE))) - edge
+            assert found_rtree == found_hash == set(np.flatnonzero(distance <= DISTANCE).tolist()) - edge
+
+
+def test_removed_agents_are_not_found():
+    for (rtree, hashed), agents, _ in moved_spaces(moves=1):
+        for space, space_agents in zip((rtree, hashed), agents):
+            space.remove_agents(space_agents[::2])
+            query = GeoAgent(-1, Model(), box(-50, -50, 150, 150))
+            assert ids(space.get_intersecting_agents(query)) == list(range(1, 300, 2))
+
+
+def static_space(seed=0, n=200):
+    """A space with static boxes and discs, and the list of them."""
+    rng = np.random.default_rng(seed)
+    model = Model()
+    areas = []
+    for i, (x, y, size) in enumerate(zip(*rng.uniform(0, 100, (2, n)), rng.uniform(0.5, 6, n))):
+        shape = box(x, y, x + size, y + size) if i % 2 else Point(x, y).buffer(size)
+        areas.append(GeoAgent(i, model, shape))
+    space = GeoSpace()
+    space.add_agents(areas)
+    return space, areas
+
+
+def pairs(geometry_index, agent_index, agents):
+    return sorted(zip(geometry_index.tolist(), (agents[i].unique_id for i in agent_index.tolist())))
+
+
+def test_query_matches_intersecting_agents():
+    space, _ = static_space()
+    rng = np.random.default_rng(1)
+    model = Model()
+    queries = [GeoAgent(-1, model, box(x, y, x + w, y + h))
+               for x, y, w, h in zip(*rng.uniform(0, 100, (2, 50)), *rng.uniform(1, 15, (2, 50)))]
+    expected = sorted((i, area.unique_id) for i, query in enumerate(queries)
+                      for area in space.get_intersecting_agents(query))
+    assert expected
+    found = space.query([query.shape for query in queries])
+    assert pairs(*found, space.static_agents) == expected
+
+
+def test_query_points_match_neighbors_within_distance():
+    space, areas = static_space()
+    rng = np.random.default_rng(2)
+    model = Model()
+    x, y = rng.uniform(0, 100, (2, 100))
+    points = [PointAgent(-1, model, Point(px, py)) for px, py in zip(x.tolist(), y.tolist())]
+    expected, edges = [], []
+    for point in points:
+        # The buffer of get_neighbors_within_distance is a polygon, areas right at the distance may fall outside it
+        found = {area.unique_id for area in space.get_neighbors_within_distance(point, DISTANCE)}
+        edges.append({area.unique_id for area in areas
+                      if 0.99 * DISTANCE < point.shape.distance(area.shape) <= DISTANCE})
+        expected.append(sorted(found - edges[-1]))
+    assert any(expected)
+
+    # Given agents are indexed in the order they are passed in
+    for agents in (None, areas[::-1]):
+        geometry_index, agent_index = space.query_points(x, y, "dwithin", DISTANCE, agents)
+        found = [set() for _ in points]
+        for i, unique_id in pairs(geometry_index, agent_index, agents or space.static_agents):
+            found[i].add(unique_id)
+        assert [sorted(near - edge) for near, edge in zip(found, edges)] == expected
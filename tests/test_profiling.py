@@ -0,0 +1,16 @@
+import pytest
+
+from tsunami_model.model import TsunamiModel
+
+
+@pytest.mark.parametrize("engine", ["agents", "vectorized"])
+def test_lookups_are_counted(engine):
+    model = TsunamiModel(150, 30, engine=engine, seed=7, records_file=None, profile=True)
+    for _ in range(300):
+        model.step()
+    totals = model.profiler.to_frame().sum()
+    # Persons reached markers and looked up the next one, and came close to each other
+    assert totals["spatial_queries"] > 0
+    assert 0 < totals["spatial_candidates"] <= totals["spatial_queries"]
+    assert totals["contact_queries"] > 0
+    assert totals["contact_pairs"] > 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from tsunami_model.recorder import TrajectoryRecorder, open_trajectories
+
+
+def test_rows_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    # Projected coordinates of the beach, where float32 would round to half a metre
+    x = 1.2e6 + rng.uniform(0, 500, (5, 4))
+    y = 4.65e6 + rng.uniform(0, 500, (5, 4))
+    state = rng.integers(0, 5, (5, 4), dtype=np.uint8)
+    target = rng.integers(-1, 10, (5, 4), dtype=np.int32)
+    recorder = TrajectoryRecorder(str(tmp_path), ["a", "b", "c", "d"], 10, ("susceptible", "safe"),
+                                  markers=np.zeros((10, 2)), queue_size=2)
+    for step in range(5):
+        recorder.record(step, x[step], y[step], state[step], target[step])
+    recorder.close()
+
+    data = open_trajectories(str(tmp_path))
+    assert data["meta"]["steps"] == 5
+    assert data["meta"]["person_ids"] == ["a", "b", "c", "d"]
+    np.testing.assert_array_equal(data["x"], x)
+    np.testing.assert_array_equal(data["y"], y)
+    np.testing.assert_array_equal(data["state"], state)
+    np.testing.assert_array_equal(data["target"], target)
+    assert data["markers"].shape == (10, 2)
+
+
+def test_record_after_close_raises(tmp_path):
+    recorder = TrajectoryRecorder(str(tmp_path), [0], 2)
+    recorder.close()
+    with pytest.raises(ValueError):
+        recorder.record(0, [0.0], [0.0], [0], [0])
+
+
+def test_writer_error_is_raised(tmp_path):
+    recorder = TrajectoryRecorder(str(tmp_path), [0, 1], 10, queue_size=1)
+    recorder.record(0, [0.0, 1.0], [0.0, 1.0], [0, 0], [0, 0])
+    recorder.record(1, [0.0, 1.0, 2.0], [0.0], [0], [0])  # Rows of the wrong length stop the writer
+    with pytest.raises(RuntimeError):
+        for step in range(2, 10):
+            recorder.record(step, [0.0, 1.0], [0.0, 1.0], [0, 0], [0, 0])
+    # Closing still keeps the rows written before the error
+    with pytest.raises(RuntimeError):
+        recorder.close()
+    assert open_trajectories(str(tmp_path))["meta"]["steps"] == 1
@@ -0,0 +1,44 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from tsunami_model.routing import NO_MARKER, RoutingGraph
+
+
+def test_next_hop_takes_the_shortest_path():
+    # Marker 1 is in the zone, but going through markers 2 and 3 is shorter;
+    # markers 4 and 5 only link to each other and cannot reach the zone
+    graph = RoutingGraph([0, 10, 1, 1, 50, 55], [0, 0, 0, 3, 50, 50], [[1, 2], [], [3], [], [5], [4]],
+                         np.array([20.0, 0.0, 3.0, 0.0, 60.0, 60.0]))
+    np.testing.assert_allclose(graph.distance, [4.0, 0.0, 3.0, 0.0, np.inf, np.inf], atol=1e-6)
+    assert graph.next_hop.tolist() == [2, NO_MARKER, 3, NO_MARKER, NO_MARKER, NO_MARKER]
+    assert graph.second_hop.tolist() == [1, NO_MARKER, NO_MARKER, NO_MARKER, NO_MARKER, NO_MARKER]
+
+
+def test_next_hops_follow_dijkstra_paths():
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(0, 100, (2, 200))
+    zone_distance = np.maximum(90 - y, 0)
+    graph = RoutingGraph.within_radius(x, y, zone_distance, 12)
+
+    # Shortest paths from the zone node on the reversed graph, the markers in the zone lead into it
+    n = len(x)
+    rows, cols, weights = [], [], []
+    for i in range(n):
+        for j in graph.tree.query_ball_point([x[i], y[i]], 12):
+            if j != i:
+                rows.append(j)
+                cols.append(i)
+                weights.append(np.hypot(x[i] - x[j], y[i] - y[j]))
+        if zone_distance[i] == 0:
+            rows.append(n)
+            cols.append(i)
+            weights.append(1e-9)
+    reversed_graph = csr_matrix((weights, (rows, cols)), shape=(n + 1, n + 1))
+    distance, predecessor = dijkstra(reversed_graph, indices=n, return_predecessors=True)
+
+    np.testing.assert_allclose(graph.distance, distance[:n], atol=1e-6)
+    # Markers whose path goes through another marker step to the next marker of that path
+    through = (predecessor[:n] >= 0) & (predecessor[:n] != n)
+    assert through.sum() > n // 2
+    np.testing.assert_array_equal(graph.next_hop[through], predecessor[:n][through])
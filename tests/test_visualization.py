@@ -0,0 +1,97 @@
+import asyncio
+import time
+
+import pytest
+
+from mesa_geo.visualization.MapModule import MapModule
+from mesa_geo.visualization.ModularVisualization import ModelRunner, SessionPool
+from tsunami_model.model import TsunamiModel
+
+STEP_SECONDS = 0.05
+PROMPT = 5 * STEP_SECONDS
+
+
+class SlowModel:
+    """Model that never ends, with steps slow enough to be interrupted."""
+
+    def __init__(self):
+        self.running = True
+        self.steps = 0
+
+    def step(self):
+        time.sleep(STEP_SECONDS)
+        self.steps += 1
+
+
+def timed(function, *args):
+    start = time.monotonic()
+    result = function(*args)
+    return time.monotonic() - start, result
+
+
+def test_runner_takes_commands_while_playing():
+    runner = ModelRunner(SlowModel())
+    runner.play()
+    time.sleep(4 * STEP_SECONDS)
+
+    elapsed, _ = timed(runner.pause)
+    assert elapsed < PROMPT
+    time.sleep(2 * STEP_SECONDS)
+    paused_at = runner.steps
+    time.sleep(4 * STEP_SECONDS)
+    assert runner.steps == paused_at
+
+    runner.play()
+    time.sleep(4 * STEP_SECONDS)
+    assert runner.steps > paused_at
+    elapsed, _ = timed(runner.stop)
+    assert elapsed < PROMPT
+    assert not runner._thread.is_alive()
+
+
+def test_runner_renders_between_steps():
+    runner = ModelRunner(SlowModel())
+    runner.play()
+    time.sleep(2 * STEP_SECONDS)
+    with runner.frame() as model:
+        steps = model.steps
+        time.sleep(2 * STEP_SECONDS)
+        assert model.steps == steps == runner.steps
+    runner.stop()
+
+
+@pytest.mark.parametrize("processes", [0, 1])
+def test_reset_during_play_returns_promptly(processes):
+    async def scenario():
+        pool = SessionPool(SlowModel, [], processes=processes)
+        try:
+            await pool.open("session", {})
+            await pool.call("session", "command", {"type": "play"})
+            await asyncio.sleep(4 * STEP_SECONDS)
+            start = time.monotonic()
+            await pool.open("session", {})  # What a "reset" message does
+            return time.monotonic() - start
+        finally:
+            pool.close("session")
+            pool.shutdown()
+
+    assert asyncio.run(scenario()) < PROMPT
+
+
+@pytest.mark.parametrize("binary", [False, True])
+def test_map_keeps_retired_agents(binary):
+    model = TsunamiModel(150, 30, seed=7, records_file=None)
+    module = MapModule(lambda agent: {"color": agent.atype}, properties=["unique_id", "atype"], binary=binary,
+                       retired_method=lambda model: model.schedule.retired.values())
+    module.render(model)
+    sent = []
+    while len(model.schedule.retired) < 10 and model.running:
+        model.step()
+        frame = module.render(model)
+        state = frame.state if binary else frame
+        sent += [feature["properties"]["unique_id"] for feature in state.get("retired", [])]
+        assert all(feature["properties"]["color"] == "safe" for feature in state.get("retired", []))
+    # Every retired agent is sent once, and a new full frame draws them with the static agents
+    assert sorted(sent) == sorted(model.schedule.retired)
+    static = module.render_full(model)["static"]["features"]
+    assert sorted(sent) == sorted(feature["properties"]["unique_id"] for feature in static[-len(sent):])
@@ -0,0 +1,165 @@
+"""
+Headless batch runs of the TsunamiModel
+
+Runs the model to completion without any visualization, and sweeps grids of
+population sizes and seeds across a process pool:
+
+    python -m tsunami_model.batch --pop-size 100 500 --pop-child-size 10 50 --seeds 10 --output sweep.csv
+    python -m tsunami_model.batch --pop-size 100 500 --seeds 10 --interaction density
+
+Scenario trees share their prefix: run it once, take a checkpoint and `fork`
+the branches from it.
+"""
+import argparse
+import itertools
+import multiprocessing
+
+import pandas as pd
+
+from tsunami_model.model import TsunamiModel
+
+COUNTS = ["susceptible", "child_susceptible", "off_beach", "child_off_beach", "safe"]
+
+
+def run_model(pop_size, pop_child_size, seed=None, **model_kwargs):
+    """
+    Run one TsunamiModel to completion
+    :param pop_size:        Number of person agents
+    :param pop_child_size:  Number of child agents
+    :param seed:            Seed of the run
+    :param model_kwargs:    Other TsunamiModel arguments, e.g. engine="vectorized"
+    :return:                Dict with the parameters, the final counts and the clearance time in seconds
+                            (None if not everyone reached safety)
+    """
+    model_kwargs.setdefault("records_file", None)
+    model = TsunamiModel(pop_size, pop_child_size, seed=seed, **model_kwargs)
+    while model.running:
+        model.step()
+
+    result = {"pop_size": pop_size, "pop_child_size": pop_child_size, "seed": seed, "steps": model.steps}
+    for name in COUNTS:
+        result[name] = model.counts[name]
+    cleared = model.counts["safe"] == pop_size + pop_child_size
+    result["clearance_time"] = model.minute * 60 + model.second if cleared else None
+    result["time"] = f"{model.minute:02d}:{model.second:02d}"
+    return result
+
+
+def _run(params):
+    return run_model(**params)
+
+
+def run_sweep(pop_sizes, pop_child_sizes, seeds, processes=None, **model_kwargs):
+    """
+    Run every combination of population sizes and seeds across a process pool
+    :param pop_sizes:       Numbers of person agents
+    :param pop_child_sizes: Numbers of child agents
+    :param seeds:           Seeds, each combination of sizes is run once per seed
+    :param processes:       Size of the process pool, defaults to all cores
+    :param model_kwargs:    Other TsunamiModel arguments, e.g. engine="vectorized"
+    :return:                DataFrame with one row per run
+    """
+    runs = [
+        dict(pop_size=pop_size, pop_child_size=pop_child_size, seed=seed, **model_kwargs)
+        for pop_size, pop_child_size, seed in itertools.product(pop_sizes, pop_child_sizes, seeds)
+    ]
+    # Build the world cache once, instead of in every worker at the same time
+    TsunamiModel.load_world()
+
+    with multiprocessing.Pool(processes) as pool:
+        results = list(pool.imap_unordered(_run, runs))
+
+    results = pd.DataFrame(results)
+    if results.empty:
+        return results
+    return results.sort_values(["pop_size", "pop_child_size", "seed"]).reset_index(drop=True)
+
+
+def run_branch(checkpoint, scenario=None, steps=None, model_cls=TsunamiModel):
+    """
+    Restore a model from a checkpoint, apply a scenario and run it
+    :param checkpoint:  Checkpoint to start from
+    :param scenario:    Function called with the restored model before it runs, e.g. to close an exit,
+                        None to continue unchanged
+    :param steps:       Number of steps to run, None to run until the model stops
+    :param model_cls:   Class of the checkpointed model
+    :return:            Checkpoint of the model at the end of the branch
+    """
+    model = model_cls.restore(checkpoint)
+    if scenario is not None:
+        scenario(model)
+    step = 0
+    while model.running and (steps is None or step < steps):
+        model.step()
+        step += 1
+    return model.checkpoint()
+
+
+def _run_branch(params):
+    return run_branch(**params)
+
+
+def fork(checkpoint, scenarios, steps=None, processes=None, model_cls=TsunamiModel):
+    """
+    Run one branch per scenario from the same checkpoint
+    :param checkpoint:  Checkpoint to start every branch from
+    :param scenarios:   One scenario per branch, see run_branch; they must pickle, e.g. module level
+                        functions or functools.partial of them, unless processes is 0
+    :param steps:       Number of steps to run every branch, None to run until the model stops
+    :param processes:   Size of the process pool, defaults to all cores, 0 to run the branches in this process
+    :param model_cls:   Class of the checkpointed model
+    :return:            Checkpoint at the end of every branch, in the order of `scenarios`,
+                        which can be forked again
+    """
+    branches = [dict(checkpoint=checkpoint, scenario=scenario, steps=steps, model_cls=model_cls)
+                for scenario in scenarios]
+    if processes == 0:
+        return [run_branch(**branch) for branch in branches]
+    with multiprocessing.Pool(processes) as pool:
+        return pool.map(_run_branch, branches)
+
+
+def summarize(results):
+    """
+    Aggregate the runs of a sweep per population size
+    :param results:     DataFrame returned by run_sweep
+    :return:            DataFrame with the number of runs, the mean final counts and
+                        statistics of the clearance time
+    """
+    groups = results.groupby(["pop_size", "pop_child_size"])
+    summary = groups[COUNTS].mean()
+    summary["runs"] = groups.size()
+    summary["cleared"] = groups["clearance_time"].count()
+    clearance = groups["clearance_time"].describe()[["mean", "std", "min", "max"]]
+    summary = summary.join(clearance.add_prefix("clearance_"))
+    return summary.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run TsunamiModel sweeps without visualization.")
+    parser.add_argument("--pop-size", type=int, nargs="+", required=True, help="Numbers of person agents")
+    parser.add_argument("--pop-child-size", type=int, nargs="+", default=[0], help="Numbers of child agents")
+    parser.add_argument("--seeds", type=int, default=1, help="Number of seeds per combination")
+    parser.add_argument("--first-seed", type=int, default=0, help="First seed")
+    parser.add_argument("--engine", choices=["agents", "vectorized"], default="agents")
+    parser.add_argument("--spatial-index", choices=["rtree", "hash"], default="hash")
+    parser.add_argument("--interaction", choices=["blocking", "density"], default="blocking",
+                        help="How persons hold each other up")
+    parser.add_argument("--processes", type=int, default=None, help="Size of the process pool, defaults to all cores")
+    parser.add_argument("--output", help="csv file with one row per run")
+    parser.add_argument("--summary", help="csv file with the aggregated results")
+    args = parser.parse_args(argv)
+
+    results = run_sweep(args.pop_size, args.pop_child_size, range(args.first_seed, args.first_seed + args.seeds),
+                        processes=args.processes, engine=args.engine, spatial_index=args.spatial_index,
+                        interaction=args.interaction)
+    summary = summarize(results)
+    if args.output:
+        results.to_csv(args.output, index=False)
+    if args.summary:
+        summary.to_csv(args.summary, index=False)
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+"""
+Benchmarks of the TsunamiModel
+
+Builds models with fixed seeds at increasing populations and measures construction
+time, step throughput, peak memory and map rendering. Every case runs in a fresh
+process, so that peak memory is per case:
+
+    python -m tsunami_model.benchmark --output results.json
+    python -m tsunami_model.benchmark --pop-size 100 1000 --save-baseline baseline.json
+    python -m tsunami_model.benchmark --pop-size 100 1000 --compare baseline.json
+    python -m tsunami_model.benchmark --pop-size 10000 50000 --world geojsons/synthetic_5km
+    python -m tsunami_model.benchmark --pop-size 1000 --spatial-index hash
+
+--world runs the cases on a world written by tsunami_model.generator.
+
+With --compare, the exit code is 1 if any metric regressed by more than --tolerance.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+import pandas as pd
+
+from mesa_geo.visualization.MapModule import MapModule
+from tsunami_model.generator import model_class
+from tsunami_model.model import TsunamiModel
+from tsunami_model.world import World
+
+POP_SIZES = [100, 1000, 5000, 10000]
+
+# Metrics where a higher value is better, all others are better lower
+HIGHER_IS_BETTER = {"steps_per_second"}
+
+COLORS = {
+    "susceptible": "Red",
+    "child_susceptible": "LightBlue",
+    "off_beach": "Orange",
+    "child_off_beach": "DarkBlue",
+    "safe": "Green",
+}
+
+
+def portrayal(agent):
+    return {"color": COLORS.get(agent.atype, "Black"), "radius": "1"}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def frame_size(frame):
+    """Bytes sent for one MapModule frame."""
+    if hasattr(frame, "buffer"):
+        return len(frame.buffer) + len(json.dumps(frame.state))
+    return len(json.dumps(frame))
+
+
+def bench_world(world=None):
+    """
+    Time the preprocessing of the static world, which the model caches
+    :param world:   Directory of a generated world, Figueirinha if None
+    :return:    Dict with the seconds to read the GeoJSON files, to build the routing graphs and
+                surface raster, and to load the world from the cache
+    """
+    model_cls = model_class(world) if world else TsunamiModel
+    files = model_cls.geojson_regions[:3]
+    start = time.perf_counter()
+    map_areas, beach, road = World.read_geojson(
+        *files, map_id=model_cls.map_id, beach_id=model_cls.marker_beach_id, road_id=model_cls.marker_road_id)
+    loaded = time.perf_counter()
+    World.from_agents(map_areas, beach, road, model_cls.surface_resolution, model_cls.road_marker_radius)
+    preprocessed = time.perf_counter()
+    model_cls.load_world()
+    cached = time.perf_counter()
+    return {
+        "geojson_load": loaded - start,
+        "preprocessing": preprocessed - loaded,
+        "cache_load": cached - preprocessed,
+    }
+
+
+def bench_case(pop_size, pop_child_size, engine="agents", minutes=1, seed=0, spatial_index="hash", world=None):
+    """
+    Benchmark one population
+    :param pop_size:        Number of person agents
+    :param pop_child_size:  Number of child agents
+    :param engine:          Engine of the model
+    :param minutes:         Simulated minutes to measure the step throughput over
+    :param seed:            Seed of the model
+    :param spatial_index:   Index of the moving person agents
+    :param world:           Directory of a generated world, Figueirinha if None
+    :return:                Dict with the case and its metrics
+    """
+    model_cls = model_class(world) if world else TsunamiModel
+    start = time.perf_counter()
+    model_cls.load_world()
+    world_loaded = time.perf_counter()
+    model = model_cls(pop_size, pop_child_size, spatial_index=spatial_index, engine=engine, seed=seed,
+                      records_file=None)
+    built = time.perf_counter()
+    world_load = world_loaded - start
+    result = {
+        "engine": engine,
+        "spatial_index": spatial_index,
+        "pop_size": pop_size,
+        "pop_child_size": pop_child_size,
+        "construction": built - world_loaded,
+        "world_load": world_load,
+        "population": model.init_seconds["population"],
+    }
+
+    # Persons of the vectorized engine are not in the GeoSpace, so there is nothing to render
+    map_module = MapModule(portrayal, binary=True, properties=["unique_id", "atype"]) if engine == "agents" else None
+    if map_module is not None:
+        start = time.perf_counter()
+        frame = map_module.render(model)
+        result["render_full"] = time.perf_counter() - start
+        result["render_full_bytes"] = frame_size(frame)
+
+    start = time.perf_counter()
+    steps = 0
+    while model.running and steps < minutes * 60:
+        model.step()
+        steps += 1
+    elapsed = time.perf_counter() - start
+    result["steps"] = steps
+    result["steps_per_second"] = steps / elapsed if elapsed > 0 else float("inf")
+
+    if map_module is not None:
+        start = time.perf_counter()
+        frame = map_module.render(model)
+        result["render_step"] = time.perf_counter() - start
+        result["render_step_bytes"] = frame_size(frame)
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def _bench_case(params):
+    return bench_case(**params)
+
+
+def run_benchmarks(pop_sizes=POP_SIZES, child_ratio=0.2, engines=("agents", "vectorized"), minutes=1, seed=0,
+                   world=None, spatial_indexes=("rtree", "hash")):
+    """
+    Run every case in its own process
+    :param spatial_indexes: Indexes of the moving person agents to run every case with
+    :return:    Dict with the world timings and a DataFrame with one row per case
+    """
+    cases = [
+        dict(pop_size=pop_size, pop_child_size=int(pop_size * child_ratio), engine=engine, minutes=minutes, seed=seed,
+             world=world, spatial_index=spatial_index)
+        for engine in engines for spatial_index in spatial_indexes for pop_size in pop_sizes
+    ]
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        timings = pool.apply(bench_world, (world,))
+        results = [pool.apply(_bench_case, (case,)) for case in cases]
+    return timings, pd.DataFrame(results)
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Compare results with a baseline
+    :param results:     DataFrame returned by run_benchmarks
+    :param baseline:    DataFrame of the baseline, with the same columns
+    :param tolerance:   Relative change above which a metric counts as a regression
+    :return:            DataFrame with one row per case and metric, with the baseline and current value,
+                        their ratio and whether it is a regression
+    """
+    keys = ["engine", "pop_size", "pop_child_size"]
+    # Baselines from before the spatial index was recorded are compared on the other keys only
+    if "spatial_index" in results and "spatial_index" in baseline:
+        keys.insert(1, "spatial_index")
+    merged = results.merge(baseline, on=keys, suffixes=("", "_baseline"))
+    metrics = [column for column in results if column not in keys and column not in ("steps", "spatial_index")
+               and column + "_baseline" in merged]
+    rows = []
+    for _, row in merged.iterrows():
+        for metric in metrics:
+            current, previous = row[metric], row[metric + "_baseline"]
+            if pd.isna(current) or pd.isna(previous) or previous == 0:
+                continue
+            ratio = current / previous
+            worse = ratio < 1 - tolerance if metric in HIGHER_IS_BETTER else ratio > 1 + tolerance
+            rows.append(dict({key: row[key] for key in keys}, metric=metric, baseline=previous, current=current,
+                             ratio=ratio, regression=worse))
+    return pd.DataFrame(rows)
+
+
+def save(path, world, results):
+    with open(path, "w") as file:
+        json.dump({"world": world, "cases": results.to_dict(orient="records")}, file, indent=2)
+
+
+def load(path):
+    with open(path) as file:
+        data = json.load(file)
+    return data["world"], pd.DataFrame(data["cases"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark TsunamiModel construction, stepping, memory and rendering.")
+    parser.add_argument("--pop-size", type=int, nargs="+", default=POP_SIZES, help="Numbers of person agents")
+    parser.add_argument("--child-ratio", type=float, default=0.2, help="Children per person agent")
+    parser.add_argument("--engine", choices=["agents", "vectorized"], nargs="+", default=["agents", "vectorized"])
+    parser.add_argument("--minutes", type=float, default=1, help="Simulated minutes to measure stepping over")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--spatial-index", choices=["rtree", "hash"], nargs="+", default=["rtree", "hash"],
+                        help="Indexes of the moving person agents")
+    parser.add_argument("--world", help="Directory of a world written by tsunami_model.generator")
+    parser.add_argument("--output", help="json file with the results")
+    parser.add_argument("--save-baseline", help="json file to save the results to as a baseline")
+    parser.add_argument("--compare", help="json file of a baseline to compare the results with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Relative change counted as a regression")
+    args = parser.parse_args(argv)
+
+    world, results = run_benchmarks(args.pop_size, args.child_ratio, args.engine, args.minutes, args.seed,
+                                    args.world, args.spatial_index)
+    print("World: " + ", ".join("{} {:.3f}s".format(name, seconds) for name, seconds in world.items()))
+    print(results.to_string(index=False, float_format=lambda value: "{:.4g}".format(value)))
+    for path in (args.output, args.save_baseline):
+        if path:
+            save(path, world, results)
+
+    if args.compare:
+        _, baseline = load(args.compare)
+        comparison = compare(results, baseline, args.tolerance)
+        print(comparison.to_string(index=False, float_format=lambda value: "{:.4g}".format(value)))
+        regressions = comparison[comparison["regression"]] if not comparison.empty else comparison
+        if not regressions.empty:
+            print("{} regressions".format(len(regressions)))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,91 @@
+import io
+import json
+import os
+import random
+
+import numpy as np
+import pandas as pd
+
+# Bump when the layout of the checkpoint files changes
+CHECKPOINT_VERSION = 6
+
+# PersonAgent attributes that are drawn once, when the person is created
+PERSON_ATTRIBUTES = {
+    "break_rules_percent": np.int16,
+    "speed_old": np.float64,
+    "speed_penalty": np.float64,
+    "speed_old_child": np.float64,
+    "speed_penalty_child": np.float64,
+}
+
+
+class Checkpoint:
+    """Full state of a running TsunamiModel at one step.
+
+    `meta` holds the scalars: clock, model parameters and the scalar parts of
+    the random generator states. `arrays` holds one NumPy array per person
+    attribute, the departure times, the order of the active agents, the
+    counts with their time series and the random generator keys.
+    Checkpoints are written with `TsunamiModel.checkpoint` and turned back
+    into a model with `TsunamiModel.restore`. They pickle as plain arrays, so
+    they can be sent to worker processes.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+
+    def __repr__(self):
+        return "Checkpoint({} at {:02d}:{:02d}, {} persons)".format(
+            self.meta["model"], self.meta["minute"], self.meta["second"], len(self.arrays["person_ids"]))
+
+    @property
+    def steps(self):
+        return self.meta["steps"]
+
+    def to_frame(self):
+        """Recorded counts as a DataFrame with one row per step and one column per state."""
+        frame = pd.DataFrame(self.arrays["counts_series"], columns=self.meta["states"])
+        frame.index.name = "step"
+        return frame
+
+    def to_bytes(self):
+        """Compressed binary form of the checkpoint, a NumPy .npz archive."""
+        buffer = io.BytesIO()
+        meta = np.frombuffer(json.dumps(self.meta).encode(), dtype=np.uint8)
+        np.savez_compressed(buffer, meta=meta, **self.arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Read a checkpoint written by `to_bytes`."""
+        with np.load(io.BytesIO(data)) as tables:
+            meta = json.loads(tables["meta"].tobytes().decode())
+            if meta.get("version") != CHECKPOINT_VERSION:
+                raise ValueError("Checkpoint has an unsupported version")
+            arrays = {name: tables[name] for name in tables.files if name != "meta"}
+        return cls(meta, arrays)
+
+    def save(self, path):
+        """Write the checkpoint to a file, atomically."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(self.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a checkpoint written by `save`."""
+        with open(path, "rb") as file:
+            return cls.from_bytes(file.read())
+
+
+def random_state(generator):
+    """State of a `random.Random`, or of the `random` module, as a key array and the cached gaussian."""
+    _, keys, gauss_next = generator.getstate()
+    return np.array(keys, dtype=np.uint32), gauss_next
+
+
+def set_random_state(generator, keys, gauss_next):
+    """Restore a state returned by `random_state`."""
+    generator.setstate((random.Random.VERSION, tuple(int(key) for key in keys), gauss_next))
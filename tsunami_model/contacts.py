@@ -0,0 +1,111 @@
+import numpy as np
+from scipy.spatial import cKDTree
+
+from tsunami_model.agents import PersonState
+
+MOVING_STATES = frozenset(state for state in PersonState if state != PersonState.SAFE)
+
+# Weidmann's fundamental diagram of pedestrian flow: speed falls with the density of the crowd,
+# to 0 at MAX_DENSITY persons per square metre
+WEIDMANN_GAMMA = 1.913
+MAX_DENSITY = 5.4
+
+
+def find_blocked(x, y, target, distance, radius=3, profiler=None):
+    """
+    Find the persons that are blocked by someone in front of them
+    :param x:           x coordinates of the persons
+    :param y:           y coordinates of the persons
+    :param target:      Index of the target marker of each person
+    :param distance:    Distance of each person to its target marker
+    :param radius:      Contact distance
+    :param profiler:    Profiler that counts the persons queried and the pairs in contact they give
+    :return:            Boolean array, True where another person within `radius` goes to
+                        the same marker and is closer to it
+    """
+    blocked = np.zeros(len(x), dtype=bool)
+    if len(x) < 2:
+        return blocked
+    pairs = cKDTree(np.column_stack((x, y))).query_pairs(radius, output_type="ndarray")
+    if profiler is not None:
+        profiler.count("contact_queries", len(x))
+        profiler.count("contact_pairs", len(pairs))
+    if len(pairs) == 0:
+        return blocked
+    i, j = pairs[:, 0], pairs[:, 1]
+    same = target[i] == target[j]
+    i, j = i[same], j[same]
+    blocked[i[distance[i] > distance[j]]] = True
+    blocked[j[distance[j] > distance[i]]] = True
+    return blocked
+
+
+def speed_factors(x, y, cell_size=2.0, min_factor=0.05):
+    """
+    Speed of every person relative to its free walking speed, from the density of the crowd around it
+    Positions are binned into square cells with one histogram of the cell indices. The density
+    around a person is the number of other persons in its cell per square metre, and gives the
+    factor through Weidmann's fundamental diagram. Cost is linear in the number of persons.
+    :param x:           x coordinates of the persons
+    :param y:           y coordinates of the persons
+    :param cell_size:   Side of the cells, in metres; at most 3 / sqrt(2) for persons that keep 3 m
+                        from everyone else to share no cell, and walk at their free speed
+    :param min_factor:  Lowest factor, so that persons in a jam still creep forward
+    :return:            Factor of every person, 1 for those alone in their cell
+    """
+    if len(x) < 2:
+        return np.ones(len(x))
+    column = np.floor(x / cell_size).astype(np.int64)
+    row = np.floor(y / cell_size).astype(np.int64)
+    column -= column.min()
+    row -= row.min()
+    cell = column * (row.max() + 1) + row
+    others = np.bincount(cell)[cell] - 1
+    with np.errstate(divide="ignore"):
+        spacing = cell_size * cell_size / others  # Square metres per other person, inf when alone
+    factor = 1 - np.exp(-WEIDMANN_GAMMA * (spacing - 1 / MAX_DENSITY))
+    return np.clip(factor, min_factor, 1)
+
+
+def update_contacts(persons, radius=3, profiler=None):
+    """
+    Contact phase of a step: set `blocked` on every moving PersonAgent at once
+    :param persons:     Agents of the model, only the moving persons among them are considered
+    :param radius:      Contact distance
+    :param profiler:    Profiler that counts the contact lookups, see `find_blocked`
+    """
+    moving = []
+    for person in persons:
+        if getattr(person, "state", None) in MOVING_STATES:
+            person.blocked = False
+            moving.append(person)
+    if len(moving) < 2:
+        return
+
+    marker_ids = {}
+    x = np.empty(len(moving))
+    y = np.empty(len(moving))
+    target = np.empty(len(moving), dtype=np.int64)
+    distance = np.empty(len(moving))
+    for i, person in enumerate(moving):
+        x[i] = person.x
+        y[i] = person.y
+        target[i] = marker_ids.setdefault(tuple(person.target_marker), len(marker_ids))
+        distance[i] = person.get_distance_to_target_marker()
+
+    for person, blocked in zip(moving, find_blocked(x, y, target, distance, radius, profiler)):
+        person.blocked = bool(blocked)
+
+
+def update_density(persons, cell_size=2.0):
+    """
+    Density phase of a step, instead of the contact phase: set `speed_factor` on every moving
+    PersonAgent at once
+    :param persons:     Agents of the model, only the moving persons among them are considered
+    :param cell_size:   Side of the density cells, in metres
+    """
+    moving = [person for person in persons if getattr(person, "state", None) in MOVING_STATES]
+    x = np.fromiter((person.x for person in moving), dtype=float, count=len(moving))
+    y = np.fromiter((person.y for person in moving), dtype=float, count=len(moving))
+    for person, factor in zip(moving, speed_factors(x, y, cell_size).tolist()):
+        person.speed_factor = factor
@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+
+
+class StateCounter:
+    """Number of persons in each state, kept up to date on state transitions.
+
+    Counts are only changed when a person enters the model or changes state,
+    never recounted. `record` copies the current counts into a preallocated
+    time series, which `to_frame` exposes as a DataFrame.
+    """
+
+    def __init__(self, states, max_steps):
+        """
+        Create counters at zero
+        :param states:      Names of the states, in code order
+        :param max_steps:   Number of rows of the time series to preallocate, it grows past that if needed
+        """
+        self.states = tuple(states)
+        self.codes = {name: code for code, name in enumerate(self.states)}
+        self.values = np.zeros(len(self.states), dtype=np.int64)
+        self.series = np.zeros((max_steps, len(self.states)), dtype=np.int64)
+        self.steps_recorded = 0
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
+    def __getitem__(self, state):
+        return int(self.values[self.codes[state]])
+
+    def __iter__(self):
+        return iter(self.states)
+
+    def items(self):
+        return [(state, int(value)) for state, value in zip(self.states, self.values)]
+
+    def as_dict(self):
+        return dict(self.items())
+
+    @property
+    def total(self):
+        return int(self.values.sum())
+
+    def add(self, state, n=1):
+        """Count `n` new persons in `state`."""
+        self.values[self.codes[state]] += n
+
+    def transition(self, old_state, new_state):
+        """Move one person from `old_state` to `new_state`."""
+        if old_state != new_state:
+            self.values[self.codes[old_state]] -= 1
+            self.values[self.codes[new_state]] += 1
+
+    def transitions(self, old_codes, new_codes):
+        """Move many persons at once, given arrays of their old and new state codes."""
+        n = len(self.states)
+        self.values -= np.bincount(old_codes, minlength=n)
+        self.values += np.bincount(new_codes, minlength=n)
+
+    def record(self, step):
+        """Store the current counts as row `step` of the time series."""
+        if step >= len(self.series):
+            grown = np.zeros((max(step + 1, 2 * len(self.series)), len(self.states)), dtype=np.int64)
+            grown[:len(self.series)] = self.series
+            self.series = grown
+        self.series[step] = self.values
+        self.steps_recorded = max(self.steps_recorded, step + 1)
+
+    def load(self, values, series):
+        """Replace the current counts and the recorded time series, e.g. with those of a checkpoint."""
+        self.values = np.array(values, dtype=np.int64)
+        self.steps_recorded = len(series)
+        if self.steps_recorded > len(self.series):
+            self.series = np.zeros((self.steps_recorded, len(self.states)), dtype=np.int64)
+        self.series[:self.steps_recorded] = series
+
+    @property
+    def model_vars(self):
+        """
+        Recorded counts per state, in the layout of DataCollector.model_vars
+        Values are Python ints, so that they can be sent as JSON, e.g. by ChartModule.
+        """
+        return {state: self.series[:self.steps_recorded, code].tolist() for code, state in enumerate(self.states)}
+
+    def to_frame(self):
+        """Recorded counts as a DataFrame with one row per step and one column per state."""
+        frame = pd.DataFrame(self.series[:self.steps_recorded], columns=list(self.states))
+        frame.index.name = "step"
+        return frame
@@ -0,0 +1,163 @@
+import numpy as np
+
+from tsunami_model.agents import PersonState
+from tsunami_model.contacts import find_blocked, speed_factors
+from tsunami_model.routing import NO_MARKER
+from tsunami_model.surface import OFF_BEACH_ZONE, SAFE_ZONE
+
+# Integer codes of the PersonAgent states
+SUSCEPTIBLE = PersonState.SUSCEPTIBLE.value
+CHILD_SUSCEPTIBLE = PersonState.CHILD_SUSCEPTIBLE.value
+OFF_BEACH = PersonState.OFF_BEACH.value
+CHILD_OFF_BEACH = PersonState.CHILD_OFF_BEACH.value
+SAFE = PersonState.SAFE.value
+
+
+class VectorizedEngine:
+    """Structure-of-arrays engine that advances all persons in one batched step."""
+
+    touch_distance = 3
+    arrival_distance = 1
+    road_marker_distance = 15
+    density_cell_size = 2.0
+
+    def __init__(self, model, persons, beach_routing, road_routing, surface, target, second_target):
+        """
+        Create a new engine from the agents built by the model
+        :param model:           Model in which the engine runs
+        :param persons:         PersonAgents, in creation order
+        :param beach_routing:   RoutingGraph of the beach markers
+        :param road_routing:    RoutingGraph of the road markers
+        :param surface:         SurfaceRaster of the map, for speed penalties and zones
+        :param target:          Initial target of every person, a node of the beach routing graph
+        :param second_target:   Initial second target of every person, a node of the beach routing graph
+        """
+        self.model = model
+        self.persons = persons
+        self.surface = surface
+
+        # Markers: beach markers first, then road markers
+        self.n_beach = len(beach_routing)
+        self.marker_x = np.concatenate((beach_routing.x, road_routing.x))
+        self.marker_y = np.concatenate((beach_routing.y, road_routing.y))
+        road_next = np.where(road_routing.next_hop == NO_MARKER, NO_MARKER, road_routing.next_hop + self.n_beach)
+        road_second = np.where(road_routing.second_hop == NO_MARKER, NO_MARKER, road_routing.second_hop + self.n_beach)
+        self.next_marker = np.concatenate((beach_routing.next_hop, road_next)).astype(np.int32)
+        self.second_next_marker = np.concatenate(
+            (np.full(self.n_beach, NO_MARKER), road_second)).astype(np.int32)
+        self.beach_tree = beach_routing.tree
+        self.road_tree = road_routing.tree
+
+        # Persons
+        n = len(persons)
+        self.x = np.array([p.x for p in persons], dtype=float)
+        self.y = np.array([p.y for p in persons], dtype=float)
+        is_child = np.array([p.state == CHILD_SUSCEPTIBLE for p in persons], dtype=bool)
+        self.speed_normal = np.array(
+            [p.speed_old_child if child else p.speed_old for p, child in zip(persons, is_child)]
+        )
+        self.speed_penalty = np.array(
+            [p.speed_penalty_child if child else p.speed_penalty for p, child in zip(persons, is_child)]
+        )
+        self.state = np.array([p.state for p in persons], dtype=np.int8)
+        self.moving_to_safety = np.zeros(n, dtype=bool)
+        self.target = np.asarray(target, dtype=np.int32).copy()
+        self.second_target = np.asarray(second_target, dtype=np.int32).copy()
+        # Time at which every person leaves, persons only move from the step after it
+        self.departure = np.zeros(n, dtype=np.int32)
+        # "blocking" or "density", see TsunamiModel
+        self.interaction = "blocking"
+
+    def step(self):
+        """Advance all persons by one second and update the model counts."""
+        active = np.flatnonzero((self.state < SAFE) & (self.departure < self.model.steps))
+        x, y = self.x[active], self.y[active]
+        state = self.state[active]
+        target = self.target[active]
+        second = self.second_target[active]
+        safety = self.moving_to_safety[active]
+
+        # Speed penalty on sand and zone at the start of the move
+        on_sand = self.surface.slow_mask(x, y)
+        speed = np.where(on_sand, self.speed_penalty[active], self.speed_normal[active])
+        in_off_beach = self.surface.zones(x, y) == OFF_BEACH_ZONE
+
+        # Persons behind someone going to the same marker are blocked,
+        # on the road they side-step towards their second target instead
+        has_target = target != NO_MARKER
+        if self.interaction == "density":
+            # Nobody is blocked, everyone is slowed down by the crowd around it
+            speed = speed * speed_factors(x, y, self.density_cell_size)
+            blocked = np.zeros(len(active), dtype=bool)
+        else:
+            distance = np.where(
+                has_target, np.hypot(x - self.marker_x[target], y - self.marker_y[target]), 0
+            )
+            blocked = find_blocked(x, y, target, distance, self.touch_distance, self.model.profiler)
+        can_move = ~blocked | safety
+        correct = np.where(blocked & safety, second, target)
+
+        # Move towards the correct marker
+        new_x, new_y = x.copy(), y.copy()
+        dx = self.marker_x[correct] - x
+        dy = self.marker_y[correct] - y
+        size = np.hypot(dx, dy)
+        movers = np.flatnonzero(can_move & has_target & (correct != NO_MARKER) & (size > 0))
+        new_x[movers] += speed[movers] * dx[movers] / size[movers]
+        new_y[movers] += speed[movers] * dy[movers] / size[movers]
+
+        # On top of a marker: continue to its next marker
+        c_distance = np.hypot(new_x[movers] - self.marker_x[correct[movers]],
+                              new_y[movers] - self.marker_y[correct[movers]])
+        arrived = movers[c_distance < self.arrival_distance]
+        for road, tree, offset in ((False, self.beach_tree, 0), (True, self.road_tree, self.n_beach)):
+            group = arrived[safety[arrived] == road]
+            if not len(group):
+                continue
+            d, nearest = tree.query(np.column_stack((new_x[group], new_y[group])))
+            found = d <= speed[group]
+            self.model.profiler.count("spatial_queries", len(group))
+            self.model.profiler.count("spatial_candidates", int(found.sum()))
+            group, nearest = group[found], nearest[found] + offset
+            target[group] = self.next_marker[nearest]
+            if road:
+                second[group] = self.second_next_marker[nearest]
+
+        # Entering an off-beach area: head for the closest road marker
+        entering = np.flatnonzero(can_move & ~safety & in_off_beach)
+        if len(entering):
+            state[entering] = np.where(state[entering] == SUSCEPTIBLE, OFF_BEACH, CHILD_OFF_BEACH)
+            d, nearest = self.road_tree.query(np.column_stack((new_x[entering], new_y[entering])))
+            found = d <= self.road_marker_distance
+            self.model.profiler.count("spatial_queries", len(entering))
+            self.model.profiler.count("spatial_candidates", int(found.sum()))
+            group, marker = entering[found], nearest[found] + self.n_beach
+            target[group] = marker
+            second[group] = self.next_marker[marker]
+            safety[entering] = True
+
+        # Reaching a safe area
+        state[self.surface.zones(new_x, new_y) == SAFE_ZONE] = SAFE
+
+        changed = np.flatnonzero(state != self.state[active])
+        self.model.counts.transitions(self.state[active[changed]], state[changed])
+
+        self.x[active], self.y[active] = new_x, new_y
+        self.state[active] = state
+        self.target[active] = target
+        self.second_target[active] = second
+        self.moving_to_safety[active] = safety
+
+    def _marker_coords(self, marker):
+        if marker == NO_MARKER:
+            return tuple()
+        return [self.marker_x[marker], self.marker_y[marker]]
+
+    def sync_agents(self):
+        """Copy the engine state back into the PersonAgent objects."""
+        for i, person in enumerate(self.persons):
+            person.set_xy(float(self.x[i]), float(self.y[i]))
+            person.state = PersonState(self.state[i])
+            person.target_marker = self._marker_coords(self.target[i])
+            person.second_target_marker = self._marker_coords(self.second_target[i])
+            person.moving_to_safety = bool(self.moving_to_safety[i])
@@ -0,0 +1,170 @@
+"""
+Synthetic beach worlds for the TsunamiModel
+
+Writes the three GeoJSON files of the model, in the schema of the Figueirinha
+files, for a straight beach of any length:
+
+    python -m tsunami_model.generator --length 5000 --exits 40 --output-dir geojsons/synthetic_5km
+
+Seen from the sea, the beach is a row of "pessoas" and "chapeus" start areas,
+then a boardwalk ("passadiço") cut by the "escadas" exits, a parking lot
+("parque_estac") and the road ("estrada"), which leads to the "safe" areas.
+Beach markers cover the beach and the exits, road markers cover the parking
+lot and the road. Use the files with `model_class`.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+from shapely.geometry import MultiPolygon, box, mapping
+
+from tsunami_model.model import TsunamiModel
+
+MAP_FILE = "map.geojson"
+BEACH_FILE = "markers_beach.geojson"
+ROAD_FILE = "markers_road.geojson"
+
+# Near Figueirinha, so that the map view of the server still fits
+ORIGIN = (-996200.0, 4647990.0)
+
+# Depths of the bands behind the start areas, in meters
+BOARDWALK_WIDTH = 4
+EXIT_DEPTH = 10
+EXIT_WIDTH = 6
+PARKING_DEPTH = 20
+ROAD_WIDTH = 10
+SAFE_SIZE = 30
+
+
+def _polygon_feature(name, shape):
+    return {"type": "Feature", "properties": {"Nome": name}, "geometry": mapping(MultiPolygon([shape]))}
+
+
+def _point_features(first_id, x, y):
+    return [
+        {"type": "Feature", "properties": {"id": first_id + i}, "geometry": {"type": "Point", "coordinates": [px, py]}}
+        for i, (px, py) in enumerate(zip(x.tolist(), y.tolist()))
+    ]
+
+
+def _grid(minx, miny, maxx, maxy, spacing):
+    """Points of a square grid of `spacing` inside a box, centered in it."""
+    def axis(low, high):
+        n = max(int((high - low) // spacing), 1)
+        return low + (high - low - (n - 1) * spacing) / 2 + spacing * np.arange(n)
+    x, y = np.meshgrid(axis(minx, maxx), axis(miny, maxy))
+    return x.ravel(), y.ravel()
+
+
+def _write(path, name, features, crs):
+    collection = {
+        "type": "FeatureCollection",
+        "name": name,
+        "crs": {"type": "name", "properties": {"name": "urn:ogc:def:crs:" + crs.replace(":", "::")}},
+        "features": features,
+    }
+    with open(path, "w") as file:
+        json.dump(collection, file)
+
+
+def generate_world(output_dir, length=1000, exits=8, beach_width=50, start_area_width=50, safe_areas=2,
+                   beach_marker_spacing=6, road_marker_spacing=5, origin=ORIGIN, crs="EPSG:3857"):
+    """
+    Write a synthetic straight beach
+    :param output_dir:              Directory of the GeoJSON files
+    :param length:                  Length of the beach along the coast, in meters
+    :param exits:                   Number of escadas, evenly spaced along the beach
+    :param beach_width:             Depth of the start areas, from the waterline to the boardwalk
+    :param start_area_width:        Length of each pessoas or chapeus area along the coast
+    :param safe_areas:              Number of safe areas along the road, the first and last at its ends
+    :param beach_marker_spacing:    Distance between neighbouring beach markers
+    :param road_marker_spacing:     Distance between neighbouring road markers, below the 15 m at which
+                                    persons in an exit look for one
+    :param origin:                  Coordinates of the waterline at the start of the beach
+    :param crs:                     Coordinate reference system of the coordinates, in meters
+    :return:                        Paths of the map, beach marker and road marker files
+    """
+    if exits < 1 or safe_areas < 1:
+        raise ValueError("A world needs at least one exit and one safe area")
+    if road_marker_spacing >= 15:
+        raise ValueError("Road markers must be less than 15 m apart to be found from the exits")
+    x0, y0 = origin
+    boardwalk = y0 + beach_width
+    exit_top = boardwalk + EXIT_DEPTH
+    road_bottom = exit_top + PARKING_DEPTH
+    road_top = road_bottom + ROAD_WIDTH
+    # The road runs past both ends of the beach, to the first and last safe areas
+    road_start, road_end = x0 - SAFE_SIZE, x0 + length + SAFE_SIZE
+
+    features = []
+    edges = np.append(np.arange(x0, x0 + length, start_area_width), x0 + length)
+    for i, (left, right) in enumerate(zip(edges[:-1], edges[1:])):
+        name = ("pessoas" if i % 2 == 0 else "chapeus") + str(i // 2 + 1)
+        features.append(_polygon_feature(name, box(left, y0, right, boardwalk)))
+
+    exit_x = x0 + length * (np.arange(exits) + 0.5) / exits
+    for i, x in enumerate(exit_x):
+        features.append(_polygon_feature("escadas" + str(i + 1),
+                                         box(x - EXIT_WIDTH / 2, boardwalk, x + EXIT_WIDTH / 2, exit_top)))
+    walk_edges = [x0] + [edge for x in exit_x for edge in (x - EXIT_WIDTH / 2, x + EXIT_WIDTH / 2)] + [x0 + length]
+    for i, (left, right) in enumerate(zip(walk_edges[::2], walk_edges[1::2])):
+        features.append(_polygon_feature("passadiço" + str(i + 1),
+                                         box(left, boardwalk, right, boardwalk + BOARDWALK_WIDTH)))
+
+    features.append(_polygon_feature("parque_estac", box(x0, exit_top, x0 + length, road_bottom)))
+    features.append(_polygon_feature("estrada", box(road_start, road_bottom, road_end, road_top)))
+
+    safe_x = np.linspace(road_start, road_end, safe_areas) if safe_areas > 1 else np.array([road_end])
+    for i, x in enumerate(safe_x):
+        left = min(max(x - SAFE_SIZE / 2, road_start), road_end - SAFE_SIZE)
+        features.append(_polygon_feature("safe" if i == 0 else "safe" + str(i + 1),
+                                         box(left, road_bottom, left + SAFE_SIZE, road_top + SAFE_SIZE)))
+
+    # Beach markers over the beach and the boardwalk, and one in the middle of every exit
+    beach_x, beach_y = _grid(x0, y0, x0 + length, boardwalk + BOARDWALK_WIDTH, beach_marker_spacing)
+    beach_x = np.concatenate((beach_x, exit_x))
+    beach_y = np.concatenate((beach_y, np.full(exits, boardwalk + EXIT_DEPTH / 2)))
+    # Road markers over the parking lot and the road, and into the safe areas
+    road_x, road_y = _grid(road_start, exit_top, road_end, road_top, road_marker_spacing)
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = [os.path.join(output_dir, name) for name in (MAP_FILE, BEACH_FILE, ROAD_FILE)]
+    _write(paths[0], "synthetic_map", features, crs)
+    _write(paths[1], "synthetic_markers_beach", _point_features(1, beach_x, beach_y), crs)
+    _write(paths[2], "synthetic_markers_road", _point_features(len(beach_x) + 1, road_x, road_y), crs)
+    return paths
+
+
+def model_class(world_dir, base=TsunamiModel):
+    """
+    TsunamiModel subclass that runs on a generated world
+    :param world_dir:   Directory written by generate_world
+    :param base:        Model class to derive from
+    """
+    regions = [os.path.join(world_dir, name) for name in (MAP_FILE, BEACH_FILE, ROAD_FILE)]
+    return type("SyntheticTsunamiModel", (base,), {
+        "geojson_regions": regions + [regions[0]],
+        "world_cache_dir": os.path.join(world_dir, "cache"),
+    })
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the GeoJSON files of a synthetic beach for the TsunamiModel.")
+    parser.add_argument("--output-dir", required=True, help="Directory of the GeoJSON files")
+    parser.add_argument("--length", type=float, default=1000, help="Length of the beach, in meters")
+    parser.add_argument("--exits", type=int, default=8, help="Number of escadas")
+    parser.add_argument("--beach-width", type=float, default=50, help="Depth of the beach, in meters")
+    parser.add_argument("--start-area-width", type=float, default=50, help="Length of each start area, in meters")
+    parser.add_argument("--safe-areas", type=int, default=2, help="Number of safe areas along the road")
+    parser.add_argument("--beach-marker-spacing", type=float, default=6, help="Distance between beach markers")
+    parser.add_argument("--road-marker-spacing", type=float, default=5, help="Distance between road markers")
+    args = parser.parse_args(argv)
+
+    paths = generate_world(args.output_dir, args.length, args.exits, args.beach_width, args.start_area_width,
+                           args.safe_areas, args.beach_marker_spacing, args.road_marker_spacing)
+    print("\n".join(paths))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,31 @@
+import os
 import random
 import csv
+import time
+
+import numpy as np
+from scipy.spatial import cKDTree
 
-from mesa.datacollection import DataCollector
 from mesa import Model
-from mesa.time import BaseScheduler, RandomActivation
 
-from mesa_geo.geoagent import GeoAgent, AgentCreator
-from mesa_geo import GeoSpace
+from mesa_geo.geoagent import AgentCreator
+from mesa_geo import GeoSpace, PointLayer
 from shapely.geometry import Point
 
-from tsunami_model.agents import PersonAgent, MarkerAgent, MapAgent, MarkerRoadAgent
+from tsunami_model.agents import STATES, PersonAgent, PersonState, MapAgent
+from tsunami_model.checkpoint import CHECKPOINT_VERSION, PERSON_ATTRIBUTES, Checkpoint, random_state, set_random_state
+from tsunami_model.contacts import MOVING_STATES, update_contacts, update_density
+from tsunami_model.counters import StateCounter
+from tsunami_model.engine import VectorizedEngine
+from tsunami_model.profiling import NullProfiler, PhaseProfiler
+from tsunami_model.recorder import TrajectoryRecorder
+from tsunami_model.routing import NO_MARKER
+from tsunami_model.scheduler import ActivityScheduler
+from tsunami_model.surface import OFF_BEACH_ZONE
+from tsunami_model.world import World
+
+# Ways persons hold each other up, see TsunamiModel
+INTERACTIONS = ("blocking", "density")
 
 
 class TsunamiModel(Model):
@@ -17,80 +33,69 @@ class TsunamiModel(Model):
 
     # Geographical parameters for desired map
     MAP_COORDS = [38.484189, -8.944787]
-    geojson_regions = ["geojsons/map_figueirinha.geojson", "geojsons/landmarks1.geojson", "geojsons/landmarks22.geojson", "geojsons/map_figueirinha_complete.geojson"]
+    geojson_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "geojsons")
+    geojson_regions = [os.path.join(geojson_dir, "map_figueirinha.geojson"), os.path.join(geojson_dir, "landmarks1.geojson"), os.path.join(geojson_dir, "landmarks22.geojson"), os.path.join(geojson_dir, "map_figueirinha_complete.geojson")]
     marker_beach_id = "id"
     map_id = "Nome"
     marker_road_id = "id"
 
+    # Slack (in metres) of the loose index bounds of moving agents
+    index_slack = 2.5
+    # Cell size (in metres) of the spatial hash of moving agents
+    hash_cell_size = 5
+    # Cell size (in metres) of the surface and zone raster
+    surface_resolution = 1.0
+    # Distance (in metres) at which road markers are linked in the routing graph
+    road_marker_radius = 20
+    # Directory of the cached static world, None to always build it from the GeoJSON files
+    world_cache_dir = os.path.join(geojson_dir, "cache")
+
+    # Length of a run, in minutes
+    run_minutes = 35
+
     minute: int
     second: int
 
-    def __init__(self, pop_size, pop_child_size):
+    def __init__(self, pop_size, pop_child_size, spatial_index="hash", engine="agents", seed=None,
+                 records_file="experience_beach_records.csv", trajectory_file=None, profile=False,
+                 departure_delay=None, interaction="blocking"):
         """
         Create a new TsunamiModel
         :param pop_size:        Number of person agents
         :param pop_child_size:        Number of child agents
+        :param spatial_index:   Index of the moving person agents, "hash" or "rtree"
+        :param engine:          "agents" to step every PersonAgent through the scheduler,
+                                "vectorized" to advance all persons at once in NumPy arrays
+        :param seed:            Seed of `self.random` and `self.rng`, the generators of the model and its agents
+        :param records_file:    csv file written with the final counts, None to skip it
+        :param trajectory_file: Directory to stream the position, state and target of every person
+                                to at every step, None to skip it
+        :param profile:         Time the phases of every step and count spatial queries in `self.profiler`
+        :param departure_delay: Mean and standard deviation, in seconds, of the normally distributed
+                                time every person waits before leaving, None for everyone to leave at once
+        :param interaction:     "blocking" for persons to wait behind anyone within 3 m going to the same
+                                marker, "density" to slow every person down by the density of the crowd
+                                around it instead, at a cost linear in the population
         """
-        #self.schedule = BaseScheduler(self)
-        self.schedule = RandomActivation(self)
-        self.grid = GeoSpace()
-        self.steps = 0
-        self.counts = None
-        self.reset_counts()
-
-        self.minute = 0
-        self.second = 0
+        if engine not in ("agents", "vectorized"):
+            raise ValueError("engine must be 'agents' or 'vectorized'")
+        if interaction not in INTERACTIONS:
+            raise ValueError("interaction must be 'blocking' or 'density'")
+        self.interaction = interaction
+        # Generators of this model only, so that models run side by side or restored from a checkpoint
+        # neither reseed nor draw from the global ones
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.records_file = records_file
+        start = time.perf_counter()
+        start_area_list = self._init_world(spatial_index, profile)
+        world_built = time.perf_counter()
 
         # SIR model parameters
         self.pop_size = pop_size
-        self.counts["susceptible"] = pop_size
-        self.counts["child_susceptible"] = pop_child_size
-
-        self.running = True
-        self.datacollector = DataCollector(
-            {
-                "susceptible": get_susceptible_count,
-                "child_susceptible": get_child_susceptible_count,
-                "safe": get_safe_count,
-                "off_beach": get_off_beach_count,
-            }
-        )
 
         list_agent_coords = []
 
-        # Set up all regions of the map
-
-        map = AgentCreator(MapAgent, {"model": self})
-        map_areas = map.from_file(self.geojson_regions[0], unique_id=self.map_id)
-
-        marker_beach = AgentCreator(MarkerAgent, {"model": self})
-        marker_beach_agents = marker_beach.from_file(self.geojson_regions[1], unique_id=self.marker_beach_id)
-
-        marker_road = AgentCreator(MarkerRoadAgent, {"model": self})
-        marker_road_agents = marker_road.from_file(self.geojson_regions[2], unique_id=self.marker_road_id)
-
-        start_area_list = []
-        other_areas_list = []
-        off_beach_area = []
-        safe_area = []
-
-        for area in map_areas:
-            if "pessoas" in area.unique_id or "chapeus" in area.unique_id:
-                start_area_list.append(area)
-            elif "escadas" in area.unique_id:
-                off_beach_area.append(area)
-            elif "safe" in area.unique_id:
-                safe_area.append(area)
-            else:
-                other_areas_list.append(area)
-
-        self.grid.add_agents(off_beach_area)
-        self.grid.add_agents(marker_beach_agents)
-        self.grid.add_agents(start_area_list)
-        self.grid.add_agents(other_areas_list)
-        self.grid.add_agents(safe_area)
-        self.grid.add_agents(marker_road_agents)
-
         # Generate PersonAgent population
         beach_population = AgentCreator(PersonAgent, {"model": self})
 
@@ -107,13 +112,15 @@ class TsunamiModel(Model):
             this_y = center_y[0] + self.random.randint(0, spread_y) - spread_y / 2
 
             this_person = beach_population.create_agent(Point(this_x, this_y), "P" + str(i))
+            self.counts.add(this_person.atype)
             self.agents_list.append(this_person)
 
             agent_coords = [this_x, this_y]
             list_agent_coords.append(agent_coords)
 
-            self.grid.add_agents(this_person)
-            self.schedule.add(this_person)
+            if engine == "agents":
+                self.grid.add_agents(this_person, dynamic=True)
+                self.schedule.add(this_person)
 
         beach_child_population = AgentCreator(PersonAgent, {"model": self})
 
@@ -128,6 +135,7 @@ class TsunamiModel(Model):
             this_y = center_y[0] + self.random.randint(0, spread_y) - spread_y / 2
 
             this_child = beach_child_population.create_agent(Point(this_x, this_y), "C" + str(i))
+            self.counts.add(this_child.atype)
             this_child.set_agent_type("child_susceptible")
             this_child.set_agent_speed("child_susceptible")
 
@@ -136,8 +144,9 @@ class TsunamiModel(Model):
             agent_coords = [this_x, this_y]
             list_agent_coords.append(agent_coords)
 
-            self.grid.add_agents(this_child)
-            self.schedule.add(this_child)
+            if engine == "agents":
+                self.grid.add_agents(this_child, dynamic=True)
+                self.schedule.add(this_child)
 
 
         # Add the map agents to schedule AFTER person agents,
@@ -145,144 +154,399 @@ class TsunamiModel(Model):
         for agent in start_area_list:
             self.schedule.add(agent)
 
-        self.datacollector.collect(self)
-
-        # safe area mais próxima para cada marker
-        for m_agent in marker_beach_agents:
-            distance = 10000
-            for x in range(len(off_beach_area)):
-                distance_x = m_agent.shape.distance(off_beach_area[x].shape)
-                if distance_x < distance:
-                    distance = distance_x
-                    m_agent.set_distance_to_off_beach_area(distance)
-
-        # get the distance of next marker
-        for m_agent in marker_beach_agents:
-            scan_distance = 10
-            found_marker = False
-            nearest_markers = []
-            while not found_marker:
-                count = 0
-                nearest_markers = m_agent.model.grid.get_neighbors_within_distance(m_agent, scan_distance)
-
-                for m in nearest_markers:
-                    if m.atype == "marker_beach" and m.unique_id != m_agent.unique_id:
-                        found_marker = True
-                scan_distance += 5
-            nearest_markers = m_agent.model.grid.get_neighbors_within_distance(m_agent, scan_distance)
-            closest_marker = 0
-            distance = 200
-            for m_marker in nearest_markers:
-                if m_marker.atype == "marker_beach" and m_marker.unique_id != m_agent.unique_id:
-                    if m_marker.get_distance() < distance:
-                        m_agent.set_next_marker([m_marker.shape.x, m_marker.shape.y])
-                        closest_marker = m_marker
-                        distance = m_marker.get_distance()
-
-        # get closest marker of an agent
-        for person in self.agents_list:
-            person.set_start_position(person.shape.x, person.shape.y)
-            distance_closest_marker = 1000
-            marker_agents = person.model.grid.get_neighbors_within_distance(person, 1500)
-            for marker_agent in marker_agents:
-                if marker_agent.atype == "marker_beach":
-                    distance = person.shape.distance(marker_agent.shape)
-                    if distance < distance_closest_marker:
-                        distance_closest_marker = distance
-                        person.target_marker = [marker_agent.shape.x, marker_agent.shape.y]
-                        person.second_target_marker = marker_agent.get_next_marker()
-
-            # % of agents that follow the trail
-            if person.get_break_rules_percent() > 0:
-                distance = 10000
-                for off_beach_areas in off_beach_area:
-                    markers_in_safe_area = off_beach_areas.model.grid.get_intersecting_agents(off_beach_areas)
-                    for markers in markers_in_safe_area:
-                        if markers.atype == "marker_beach":
-                            distance_x = person.shape.distance(markers.shape)
-                            if distance_x < distance:
-                                distance = distance_x
-                                person.target_marker = [markers.shape.x, markers.shape.y]
+        self.counts.record(0)
+        self.profiler.instrument_space(self.grid)
+
+        # get closest marker of every person, then the closest off beach marker for those that follow the trail
+        target, second_target = self.initial_targets()
+        for person, node, second_node in zip(self.agents_list, target, second_target):
+            person.set_target_marker(self.beach_routing.coords(node))
+            person.second_target_marker = self.beach_routing.coords(second_node)
+
+        if engine == "vectorized":
+            self.engine = VectorizedEngine(self, self.agents_list, self.beach_routing, self.road_routing,
+                                           self.surface, target, second_target)
+
+        # Time at which every person leaves, in seconds
+        self.departure = np.zeros(len(self.agents_list), dtype=np.int32)
+        if departure_delay is not None:
+            mean, std = departure_delay
+            self.departure[:] = np.maximum(np.rint(self.rng.normal(mean, std, len(self.agents_list))), 0)
+        if self.engine is not None:
+            self.engine.departure = self.departure
+            self.engine.interaction = interaction
+        else:
+            for person, departure in zip(self.agents_list, self.departure.tolist()):
+                if departure > 0:
+                    self.schedule.sleep(person, departure)
+        # Seconds spent setting up the world, and creating and placing the persons
+        self.init_seconds = {"world": world_built - start, "population": time.perf_counter() - world_built}
+
+        self._start_recorder(trajectory_file)
+
+    def _init_world(self, spatial_index, profile):
+        """
+        Set up the clock, the counts, the space and the static world, without any persons
+        :param spatial_index:   Index of the moving person agents, "hash" or "rtree"
+        :param profile:         Time the phases of every step
+        :return:                Start areas of the persons, to be scheduled after them
+        """
+        # Persons that reached safety are retired from the schedule, those that did not leave yet sleep
+        self.schedule = ActivityScheduler(self)
+        self.spatial_index = spatial_index
+        self.grid = GeoSpace(slack=self.index_slack, dynamic_index=spatial_index, cell_size=self.hash_cell_size)
+        self.steps = 0
+        self.engine = None
+        self.recorder = None
+        self.profiler = PhaseProfiler() if profile else NullProfiler()
+        self._marker_index = None
+        self._retiring = []
+        # Persons per state, changed on state transitions, with their time series over the run
+        self.counts = StateCounter(STATES, self.run_minutes * 60 + 1)
+
+        self.minute = 0
+        self.second = 0
+
+        self.running = True
+
+        # Set up all regions of the map, from the cached world when the inputs did not change
+        self.world = self.load_world(self.grid.crs.srs)
+
+        map_areas = [MapAgent(unique_id, self, shape)
+                     for unique_id, shape in zip(self.world.map_ids, self.world.map_shapes)]
+
+        start_area_list = []
+        other_areas_list = []
+        off_beach_area = []
+        safe_area = []
+
+        # Surface types and zones are looked up in a raster instead of queried
+        self.surface = self.world.surface
+
+        for area in map_areas:
+            if "pessoas" in area.unique_id or "chapeus" in area.unique_id:
+                start_area_list.append(area)
+            elif "escadas" in area.unique_id:
+                off_beach_area.append(area)
+            elif "safe" in area.unique_id:
+                safe_area.append(area)
+            else:
+                other_areas_list.append(area)
+
+        self.grid.add_agents(off_beach_area)
+        self.grid.add_agents(start_area_list)
+        self.grid.add_agents(other_areas_list)
+        self.grid.add_agents(safe_area)
 
+        # Routing graphs over the markers, with next hops from shortest-path distances to the zones
+        self.beach_routing = self.world.beach_routing
         # after off beach area #########################################################################
+        self.road_routing = self.world.road_routing
+
+        # Markers are static points, looked up by their index in the routing graphs
+        self.beach_markers = self.marker_layer(self.world.beach_ids, self.beach_routing)
+        self.road_markers = self.marker_layer(self.world.road_ids, self.road_routing)
+        self.grid.add_layer("marker_beach", self.beach_markers)
+        self.grid.add_layer("marker_road", self.road_markers)
+        return start_area_list
+
+    @staticmethod
+    def marker_layer(ids, routing):
+        """PointLayer of the markers of a routing graph, with their next hops and distances as columns."""
+        return PointLayer(routing.x, routing.y, ids, {
+            "next_hop": routing.next_hop,
+            "second_hop": routing.second_hop,
+            "distance": routing.distance,
+        })
+
+    def retire(self, person):
+        """
+        Take a person that reached safety out of the schedule, and out of the spatial index at the
+        end of the step; it is still counted
+        """
+        self.schedule.retire(person)
+        self._retiring.append(person)
+
+    def _start_recorder(self, trajectory_file):
+        if trajectory_file is not None:
+            markers = np.column_stack((np.concatenate((self.beach_routing.x, self.road_routing.x)),
+                                       np.concatenate((self.beach_routing.y, self.road_routing.y))))
+            self.recorder = TrajectoryRecorder(trajectory_file, [person.unique_id for person in self.agents_list],
+                                               self.run_minutes * 60 + 1, STATES, markers)
+            self.recorder.record(self.steps, *self.person_arrays())
+
+    @classmethod
+    def load_world(cls, crs="epsg:3857"):
+        """
+        Static world of the model, loaded from the cache when the inputs did not change
+        :param crs:     Coordinate reference system of the model
+        """
+        return World.cached(
+            cls.world_cache_dir, cls.geojson_regions[0], cls.geojson_regions[1], cls.geojson_regions[2],
+            map_id=cls.map_id, beach_id=cls.marker_beach_id, road_id=cls.marker_road_id,
+            crs=crs, resolution=cls.surface_resolution, road_marker_radius=cls.road_marker_radius,
+        )
 
-        # safe area mais próxima para cada marker
-        for m_agent in marker_road_agents:
-            distance = 10000
-            for x in range(len(safe_area)):
-                distance_y = m_agent.shape.distance(safe_area[x].shape)
-                if distance_y < distance:
-                    distance = distance_y
-                    m_agent.set_distance_to_safety_area(distance)
-
-        # get the distance of next marker
-        for m_agent in marker_road_agents:
-            nearest_markers = m_agent.model.grid.get_neighbors_within_distance(m_agent, 20)
-            second_nearest_markers = []
-            closest_marker = 0
-
-            distance = 10000
-            for m_marker in nearest_markers:
-                if m_marker.atype == "marker_road" and m_marker.unique_id != m_agent.unique_id:
-                    second_nearest_markers.append(m_marker)
-                    if m_marker.get_distance() <= distance:
-                        m_agent.set_next_marker([m_marker.shape.x, m_marker.shape.y])
-                        closest_marker = m_marker
-                        distance = m_marker.get_distance()
-
-            # distance to second closest marker
-            second_nearest_markers.remove(closest_marker)
-            
-            distance_second_marker = 10000
-            for m_second_marker in second_nearest_markers:
-                if m_second_marker.atype == "marker_road" and m_second_marker.unique_id != m_agent.unique_id:
-                    if m_second_marker.get_distance() <= distance_second_marker:
-                        m_agent.set_second_next_marker([m_second_marker.shape.x, m_second_marker.shape.y])
-                        distance_second_marker = m_second_marker.get_distance()
-
-    def reset_counts(self):
-        self.counts = {
-            "susceptible": 0,
-            "child_susceptible": 0,
-            "child_off_beach": 0,
-            "safe": 0,
-            "off_beach": 0,
+    def initial_targets(self):
+        """
+        Closest beach marker of every person, or the closest beach marker of an off beach area
+        for the persons that follow the trail
+        :return:    Target and second target marker of every person, as nodes of the beach routing graph
+        """
+        routing = self.beach_routing
+        x = np.array([person.x for person in self.agents_list])
+        y = np.array([person.y for person in self.agents_list])
+        target = np.full(len(x), NO_MARKER, dtype=np.int32)
+        second_target = np.full(len(x), NO_MARKER, dtype=np.int32)
+        if len(x) == 0 or len(routing) == 0:
+            return target, second_target
+
+        distance, nearest = self.beach_markers.nearest(x, y)
+        close = distance < 1000
+        target[close] = nearest[close]
+        second_target[close] = routing.next_hop[nearest[close]]
+
+        # % of agents that follow the trail
+        follows_trail = np.array([person.get_break_rules_percent() > 0 for person in self.agents_list])
+        exits = np.flatnonzero(self.surface.zones(routing.x, routing.y) == OFF_BEACH_ZONE)
+        if len(exits):
+            distance, nearest = cKDTree(np.column_stack((routing.x[exits], routing.y[exits]))).query(
+                np.column_stack((x, y)))
+            target[follows_trail] = exits[nearest[follows_trail]]
+        return target, second_target
+
+    def person_arrays(self):
+        """
+        Positions, state codes and target markers of all persons
+        :return:    x, y, state and target arrays; targets index the beach markers and then the road markers
+        """
+        if self.engine is not None:
+            return self.engine.x, self.engine.y, self.engine.state, self.engine.target
+
+        if self._marker_index is None:
+            markers = zip(np.concatenate((self.beach_routing.x, self.road_routing.x)),
+                          np.concatenate((self.beach_routing.y, self.road_routing.y)))
+            self._marker_index = {marker: i for i, marker in enumerate(markers)}
+        n = len(self.agents_list)
+        x = np.empty(n)
+        y = np.empty(n)
+        state = np.empty(n, dtype=np.uint8)
+        target = np.empty(n, dtype=np.int32)
+        for i, person in enumerate(self.agents_list):
+            x[i] = person.x
+            y[i] = person.y
+            state[i] = person.state
+            target[i] = self._marker_index.get(tuple(person.target_marker), NO_MARKER)
+        return x, y, state, target
+
+    def sync_agents(self):
+        """Copy the state of the vectorized engine back into the PersonAgent objects."""
+        if self.engine is not None:
+            self.engine.sync_agents()
+
+    def marker_coords(self, marker):
+        """
+        Coordinates of a marker as a list, or an empty tuple for NO_MARKER
+        :param marker:  Index of the marker: beach markers first, then road markers
+        """
+        n_beach = len(self.beach_routing)
+        if marker < n_beach:
+            return self.beach_routing.coords(marker)
+        return self.road_routing.coords(marker - n_beach)
+
+    def checkpoint(self):
+        """
+        Snapshot the full state of the model
+        :return:    Checkpoint with the clock, the random generator states, the position, state, targets
+                    and speeds of every person, the schedule order and the counts with their time series
+        """
+        persons = self.agents_list
+        x, y, state, target = self.person_arrays()
+        arrays = {
+            "person_ids": np.array([str(person.unique_id) for person in persons]),
+            "x": np.array(x, dtype=np.float64),
+            "y": np.array(y, dtype=np.float64),
+            "state": np.array(state, dtype=np.uint8),
+            "target": np.array(target, dtype=np.int32),
         }
+        if self.engine is not None:
+            arrays["second_target"] = self.engine.second_target.astype(np.int32)
+            arrays["moving_to_safety"] = self.engine.moving_to_safety.copy()
+            arrays["engine_speed_normal"] = self.engine.speed_normal.copy()
+            arrays["engine_speed_penalty"] = self.engine.speed_penalty.copy()
+        else:
+            arrays["second_target"] = np.array(
+                [self._marker_index.get(tuple(person.second_target_marker), NO_MARKER) for person in persons],
+                dtype=np.int32)
+            arrays["moving_to_safety"] = np.array([person.moving_to_safety for person in persons], dtype=bool)
+        for name, dtype in PERSON_ATTRIBUTES.items():
+            arrays[name] = np.array([getattr(person, name) for person in persons], dtype=dtype)
+        arrays["departure"] = self.departure.copy()
+        arrays["schedule"] = np.array([str(agent.unique_id) for agent in self.schedule.agents])
+        arrays["counts_values"] = self.counts.values.copy()
+        arrays["counts_series"] = self.counts.series[:self.counts.steps_recorded].copy()
+
+        model_keys, model_gauss = random_state(self.random)
+        arrays["model_random"] = model_keys
+
+        meta = {
+            "version": CHECKPOINT_VERSION,
+            "model": type(self).__name__,
+            "engine": "agents" if self.engine is None else "vectorized",
+            "spatial_index": self.spatial_index,
+            "pop_size": self.pop_size,
+            "interaction": self.interaction,
+            "markers": [len(self.beach_routing), len(self.road_routing)],
+            "states": list(self.counts.states),
+            "minute": self.minute,
+            "second": self.second,
+            "steps": self.steps,
+            "running": self.running,
+            "schedule_steps": self.schedule.steps,
+            "schedule_time": self.schedule.time,
+            "model_random_gauss": model_gauss,
+            "rng": self.rng.bit_generator.state,
+        }
+        return Checkpoint(meta, arrays)
+
+    @classmethod
+    def restore(cls, checkpoint, records_file=None, trajectory_file=None, profile=False):
+        """
+        Rebuild a model from a checkpoint, without generating its population again
+        The model continues exactly as the checkpointed one would have, and does not share
+        its random generator with other models.
+        :param checkpoint:      Checkpoint returned by `checkpoint`
+        :param records_file:    csv file written with the final counts, None to skip it
+        :param trajectory_file: Directory to stream the persons to at every step, None to skip it
+        :param profile:         Time the phases of every step and count spatial queries in `self.profiler`
+        """
+        meta, arrays = checkpoint.meta, checkpoint.arrays
+        # Mesa's __new__ resets the generator it shares between all models of a class
+        model = object.__new__(cls)
+        model.random = random.Random()
+        model.rng = np.random.default_rng()
+        model.records_file = records_file
+        model.interaction = meta["interaction"]
+        start_area_list = model._init_world(meta["spatial_index"], profile)
+        if [len(model.beach_routing), len(model.road_routing)] != meta["markers"]:
+            raise ValueError("Checkpoint was taken on a different world")
+        model.pop_size = meta["pop_size"]
+
+        model.agents_list = []
+        for i, unique_id in enumerate(arrays["person_ids"].tolist()):
+            person = PersonAgent(unique_id, model, Point(arrays["x"][i], arrays["y"][i]), STATES[arrays["state"][i]])
+            for name in PERSON_ATTRIBUTES:
+                setattr(person, name, arrays[name][i].item())
+            person.speed = person.speed_old
+            person.set_target_marker(model.marker_coords(arrays["target"][i]))
+            person.second_target_marker = model.marker_coords(arrays["second_target"][i])
+            person.moving_to_safety = bool(arrays["moving_to_safety"][i])
+            model.agents_list.append(person)
+
+        model.departure = arrays["departure"].copy()
+        scheduled = {str(agent.unique_id): agent for agent in model.agents_list + start_area_list}
+        active = arrays["schedule"].tolist()
+        for unique_id in active:
+            model.schedule.add(scheduled[unique_id])
+        if meta["engine"] == "agents":
+            model.grid.add_agents([person for person in model.agents_list if person.state != PersonState.SAFE],
+                                  dynamic=True)
+            # Persons that are neither safe nor active have not left yet
+            active = set(active)
+            for person, departure in zip(model.agents_list, model.departure.tolist()):
+                if person.state == PersonState.SAFE:
+                    model.schedule.retire(person)
+                elif person.unique_id not in active:
+                    model.schedule.sleep(person, departure)
+        model.schedule.steps = meta["schedule_steps"]
+        model.schedule.time = meta["schedule_time"]
+        model.counts.load(arrays["counts_values"], arrays["counts_series"])
+        model.profiler.instrument_space(model.grid)
+
+        if meta["engine"] == "vectorized":
+            model.engine = VectorizedEngine(model, model.agents_list, model.beach_routing, model.road_routing,
+                                            model.surface, arrays["target"], arrays["second_target"])
+            model.engine.moving_to_safety[:] = arrays["moving_to_safety"]
+            model.engine.speed_normal[:] = arrays["engine_speed_normal"]
+            model.engine.speed_penalty[:] = arrays["engine_speed_penalty"]
+            model.engine.departure = model.departure
+            model.engine.interaction = model.interaction
+
+        model.minute = meta["minute"]
+        model.second = meta["second"]
+        model.steps = meta["steps"]
+        model.running = meta["running"]
+        # Persons drew from the generators of the model while they were created above
+        set_random_state(model.random, arrays["model_random"], meta["model_random_gauss"])
+        model.rng.bit_generator.state = meta["rng"]
+
+        model._start_recorder(trajectory_file)
+        return model
 
     def step(self):
         """Run one step of the model."""
         self.steps += 1
-        self.__update_clock()
-        self.reset_counts()
-        self.schedule.step()
-        self.grid._recreate_rtree()  # Recalculate spatial tree, because agents are moving
+        profiler = self.profiler
+        profiler.start_step(self.steps)
+        with profiler.phase("model.step", trace=True):
+            self._step(profiler)
+        profiler.end_step()
 
-        self.datacollector.collect(self)
+    def _step(self, profiler):
+        self.__update_clock()
+        if self.engine is None:
+            self.schedule.wake()  # Persons that leave in this step take part in the contacts
+            if self.interaction == "density":
+                with profiler.phase("density", trace=True):
+                    update_density(self.schedule.agents)
+            else:
+                with profiler.phase("contacts", trace=True):
+                    update_contacts(self.schedule.agents, profiler=profiler)
+            with profiler.phase("schedule.step", trace=True):
+                self.schedule.step()  # Moving agents update the spatial index themselves
+            if self._retiring:
+                self.grid.remove_agents(self._retiring)
+                self._retiring = []
+        else:
+            with profiler.phase("engine.step", trace=True):
+                self.engine.step()
+
+        with profiler.phase("counts.record", trace=True):
+            self.counts.record(self.steps)
 
         # Run until everyone is safe
-        if self.counts["susceptible"] == 0 and self.counts["off_beach"] == 0 and self.counts["child_susceptible"] == 0 and self.counts["child_off_beach"] == 0:
+        if self.counts["safe"] == self.counts.total:
             self.running = False
-            # create csv file with final data
-            mydict = [{'susceptible': self.counts["susceptible"],
-                       'off_beach': self.counts["off_beach"],
-                       'child_susceptible': self.counts["child_susceptible"],
-                       'child_off_beach': self.counts["child_off_beach"],
-                       'safe': self.counts["safe"],
-                       'Time': str(self.minute) + ":" + str(self.second)}]
+            self.write_records()
 
-            fields = ['susceptible', 'off_beach', 'child_susceptible', 'child_off_beach', 'safe', 'Time']
+        if self.recorder is not None:
+            with profiler.phase("recorder", trace=True):
+                self.recorder.record(self.steps, *self.person_arrays())
+                if not self.running:
+                    self.recorder.close()
 
-            filename = "experience_beach_records.csv"
+    def write_records(self):
+        """Create csv file with final data, unless records_file is None."""
+        if self.records_file is None:
+            return
+        mydict = [{'susceptible': self.counts["susceptible"],
+                   'off_beach': self.counts["off_beach"],
+                   'child_susceptible': self.counts["child_susceptible"],
+                   'child_off_beach': self.counts["child_off_beach"],
+                   'safe': self.counts["safe"],
+                   'Time': str(self.minute) + ":" + str(self.second)}]
 
-            with open(filename, 'w') as csvfile:
-                # creating a csv dict writer object
-                writer = csv.DictWriter(csvfile, fieldnames=fields)
+        fields = ['susceptible', 'off_beach', 'child_susceptible', 'child_off_beach', 'safe', 'Time']
 
-                # writing headers (field names)
-                writer.writeheader()
+        with open(self.records_file, 'w') as csvfile:
+            # creating a csv dict writer object
+            writer = csv.DictWriter(csvfile, fieldnames=fields)
 
-                # writing data rows
-                writer.writerows(mydict)
+            # writing headers (field names)
+            writer.writeheader()
+
+            # writing data rows
+            writer.writerows(mydict)
 
     def __update_clock(self) -> None:
         self.second += 1
@@ -290,51 +554,7 @@ class TsunamiModel(Model):
             self.minute += 1
             self.second = 0
         # Run until 35 minutes
-        if self.minute == 35:
+        if self.minute == self.run_minutes:
             self.running = False
 
-            # create csv file with final data
-            mydict = [{'susceptible': self.counts["susceptible"],
-                       'off_beach': self.counts["off_beach"],
-                       'child_susceptible': self.counts["child_susceptible"],
-                       'child_off_beach': self.counts["child_off_beach"],
-                       'safe': self.counts["safe"],
-                       'Time': str(self.minute) + ":" + str(self.second)}]
-
-            fields = ['susceptible', 'off_beach', 'child_susceptible', 'child_off_beach', 'safe', 'Time']
-
-            filename = "experience_beach_records.csv"
-
-            with open(filename, 'w') as csvfile:
-                # creating a csv dict writer object
-                writer = csv.DictWriter(csvfile, fieldnames=fields)
-
-                # writing headers (field names)
-                writer.writeheader()
-
-                # writing data rows
-                writer.writerows(mydict)
-
-
-# Functions needed for datacollector
-def get_susceptible_count(model):
-    return model.counts["susceptible"]
-
-
-def get_child_susceptible_count(model):
-    return model.counts["child_susceptible"]
-
-
-def get_child_off_beach_count(model):
-    return model.counts["child_off_beach"]
-
-
-def get_off_beach_count(model):
-    return model.counts["off_beach"]
-
-
-def get_safe_count(model):
-    return model.counts["safe"]
-
-
-
+            self.write_records()
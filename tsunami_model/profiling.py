@@ -0,0 +1,204 @@
+import json
+import time
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "trace", "start")
+
+    def __init__(self, profiler, name, trace):
+        self.profiler = profiler
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.add(self.name, self.start, time.perf_counter(), self.trace)
+        return False
+
+
+class _NoPhase:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class NullProfiler:
+    """Profiler of a model that is not profiled: every call is a no-op."""
+
+    enabled = False
+
+    def phase(self, name, trace=False):
+        return _NO_PHASE
+
+    def count(self, name, n=1):
+        pass
+
+    def start_step(self, step):
+        pass
+
+    def end_step(self):
+        pass
+
+    def instrument_space(self, space):
+        pass
+
+
+class PhaseProfiler:
+    """Wall-clock time spent in each phase of every step, and counts of spatial lookups.
+
+    Phases are timed with `with profiler.phase(name):`. Nested phases are timed
+    on their own and also count towards the phase around them. Phases entered
+    with trace=True are also kept as events for the Chrome trace; the other
+    phases, e.g. per-agent ones, only go into the trace as per-step totals.
+    """
+
+    enabled = True
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.step = None
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.rows = []
+        self.events = []
+        self.phases = {}  # Phase names in the order they were first seen
+        self.traced = set()  # Phases kept as trace events
+
+    def phase(self, name, trace=False):
+        """Context manager timing one call of phase `name`."""
+        return _Phase(self, name, trace)
+
+    def add(self, name, start, end, trace=False):
+        """Add one call of phase `name`, from `start` to `end` (perf_counter seconds)."""
+        self.times[name] += end - start
+        self.calls[name] += 1
+        self.phases.setdefault(name, None)
+        if trace:
+            self.traced.add(name)
+            self.events.append({
+                "name": name, "ph": "X", "pid": 0, "tid": 0,
+                "ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6,
+            })
+
+    def count(self, name, n=1):
+        """Add `n` to the counter `name` of the current step."""
+        self.counters[name] += n
+
+    def start_step(self, step):
+        self.step = step
+        self.times.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def end_step(self):
+        """Store the times and counters of the current step as a row of the per-step table."""
+        row = {"step": self.step}
+        for name, seconds in self.times.items():
+            row[name] = seconds
+            row[name + ".calls"] = self.calls[name]
+        row.update(self.counters)
+        self.rows.append(row)
+
+        # Untraced phases and counters go into the trace as per-step values
+        ts = (time.perf_counter() - self.origin) * 1e6
+        totals = {name: seconds * 1e3 for name, seconds in self.times.items() if name not in self.traced}
+        if totals:
+            self.events.append({"name": "phases (ms)", "ph": "C", "pid": 0, "ts": ts, "args": totals})
+        if self.counters:
+            self.events.append({"name": "counters", "ph": "C", "pid": 0, "ts": ts, "args": dict(self.counters)})
+
+    def instrument_space(self, space):
+        """Count the queries of a GeoSpace and of its PointLayers, e.g. the marker lookups,
+        and the candidates they return, and time its index rebuilds."""
+        def counted(query):
+            def wrapper(*args, **kwargs):
+                self.counters["spatial_queries"] += 1
+                for candidate in query(*args, **kwargs):
+                    self.counters["spatial_candidates"] += 1
+                    yield candidate
+            return wrapper
+
+        def counted_nearest(nearest):
+            def wrapper(x, y, *args, **kwargs):
+                distance, index = nearest(x, y, *args, **kwargs)
+                self.counters["spatial_queries"] += np.size(index)
+                self.counters["spatial_candidates"] += int(np.count_nonzero(np.asarray(index) >= 0))
+                return distance, index
+            return wrapper
+
+        def counted_within(within_distance):
+            def wrapper(*args, **kwargs):
+                found = within_distance(*args, **kwargs)
+                self.counters["spatial_queries"] += 1
+                self.counters["spatial_candidates"] += len(found)
+                return found
+            return wrapper
+
+        def timed(name, method):
+            def wrapper(*args, **kwargs):
+                with self.phase(name, trace=True):
+                    return method(*args, **kwargs)
+            return wrapper
+
+        space._get_rtree_intersections = counted(space._get_rtree_intersections)
+        space._get_points_within_distance = counted(space._get_points_within_distance)
+        space._recreate_rtree = timed("_recreate_rtree", space._recreate_rtree)
+        for layer in space.layers.values():
+            layer.nearest = counted_nearest(layer.nearest)
+            layer.within_distance = counted_within(layer.within_distance)
+
+    def to_frame(self):
+        """Per-step table: seconds and number of calls of every phase, and the counters."""
+        return pd.DataFrame(self.rows).set_index("step").fillna(0) if self.rows else pd.DataFrame()
+
+    def summary(self):
+        """
+        Totals over all steps
+        :return:    DataFrame with, per phase, the total seconds, the mean milliseconds per step,
+                    the number of calls and the share of the "model.step" time
+        """
+        table = self.to_frame()
+        if table.empty:
+            return pd.DataFrame()
+        phases = [name for name in self.phases if name in table]
+        total = table[phases].sum()
+        summary = pd.DataFrame({
+            "seconds": total,
+            "ms_per_step": table[phases].mean() * 1e3,
+            "calls": table[[name + ".calls" for name in phases]].sum().values,
+        })
+        if "model.step" in total:
+            summary["share"] = total / total["model.step"]
+        return summary.sort_values("seconds", ascending=False)
+
+    def report(self):
+        """Summary as text, with the mean of the counters per step."""
+        summary = self.summary()
+        if summary.empty:
+            return "No steps profiled"
+        lines = [summary.to_string(float_format=lambda value: "{:.4f}".format(value))]
+        table = self.to_frame()
+        counters = [name for name in table if name not in self.phases and not name.endswith(".calls")]
+        for name in counters:
+            lines.append("{}: {:.1f} per step".format(name, table[name].mean()))
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path):
+        """Write the profile in the Chrome trace event format, for chrome://tracing or Perfetto."""
+        with open(path, "w") as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,144 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+# Positions stay float64: at a projected northing of millions of metres float32 only resolves 0.5 m
+COLUMNS = {"x": np.float64, "y": np.float64, "state": np.uint8, "target": np.int32}
+
+
+class TrajectoryRecorder:
+    """Streams per-person positions, states and targets to memory-mapped .npy files.
+
+    Every column is a preallocated (max_steps, n_persons) array in its own
+    .npy file inside `path`. Rows are written on a background thread from a
+    bounded queue, so memory use does not grow with the run length. The files
+    can be opened zero-copy with `open_trajectories` or `np.load(..., mmap_mode="r")`.
+    An error of the writer thread is raised by the next `record` or `close`.
+    """
+
+    flush_every = 60
+    # Seconds to wait on a full queue before checking that the writer thread is still running
+    put_timeout = 0.5
+
+    def __init__(self, path, person_ids, max_steps, state_names=(), markers=None, queue_size=32):
+        """
+        Create the output files
+        :param path:        Output directory
+        :param person_ids:  unique_id of every person, in column order
+        :param max_steps:   Number of rows to preallocate, i.e. the longest run to record
+        :param state_names: Name of every state code
+        :param markers:     (n, 2) array with the coordinates of every target index
+        :param queue_size:  Number of rows that may wait for the writer thread
+        """
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.max_steps = max_steps
+        self.steps_written = 0
+        self.columns = {
+            name: np.lib.format.open_memmap(
+                os.path.join(path, name + ".npy"), mode="w+", dtype=dtype, shape=(max_steps, len(person_ids)))
+            for name, dtype in COLUMNS.items()
+        }
+        if markers is not None:
+            np.save(os.path.join(path, "markers.npy"), np.asarray(markers))
+        self.meta = {
+            "person_ids": [str(person_id) for person_id in person_ids],
+            "states": list(state_names),
+            "columns": list(COLUMNS),
+        }
+        self._write_meta()
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._thread = threading.Thread(target=self._writer, daemon=True)
+        self._thread.start()
+
+    def record(self, step, x, y, state, target):
+        """
+        Queue one row; the arrays are copied, so callers may keep changing them
+        :param step:    Row to write, usually the model step
+        """
+        if self._thread is None:
+            raise ValueError("The recorder is closed")
+        if step >= self.max_steps:
+            raise IndexError("Step {} is past the {} preallocated rows".format(step, self.max_steps))
+        self._put((step, np.array(x), np.array(y), np.array(state), np.array(target)))
+
+    def _put(self, item):
+        """Queue an item, raising the error of the writer thread instead of waiting on it forever."""
+        while True:
+            self._check_writer()
+            try:
+                self._queue.put(item, timeout=self.put_timeout)
+                return
+            except queue.Full:
+                pass
+
+    def _check_writer(self):
+        if self._error is not None:
+            raise RuntimeError("The trajectory writer failed") from self._error
+        if not self._thread.is_alive():
+            raise RuntimeError("The trajectory writer stopped")
+
+    def _writer(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                step = item[0]
+                for column, values in zip(self.columns.values(), item[1:]):
+                    column[step] = values
+                self.steps_written = max(self.steps_written, step + 1)
+                if step % self.flush_every == 0:
+                    self._flush()
+        except BaseException as error:
+            self._error = error
+
+    def _flush(self):
+        for column in self.columns.values():
+            column.flush()
+
+    def _write_meta(self):
+        self.meta["steps"] = self.steps_written
+        with open(os.path.join(self.path, "meta.json"), "w") as file:
+            json.dump(self.meta, file)
+
+    def close(self):
+        """
+        Write the queued rows, flush the files and record how many rows are valid;
+        the rows written before an error of the writer thread are kept, then the error is raised
+        """
+        if self._thread is None:
+            return
+        try:
+            self._put(None)
+            self._thread.join()
+        finally:
+            thread, self._thread = self._thread, None
+            if not thread.is_alive():
+                self._flush()
+                self._write_meta()
+        if self._error is not None:
+            raise RuntimeError("The trajectory writer failed") from self._error
+
+
+def open_trajectories(path):
+    """
+    Open a recording zero-copy
+    :param path:    Directory written by a TrajectoryRecorder
+    :return:        Dict with the read-only memory-mapped columns, cut to the recorded steps,
+                    and the recording metadata under "meta"
+    """
+    with open(os.path.join(path, "meta.json")) as file:
+        meta = json.load(file)
+    data = {"meta": meta}
+    for name in meta["columns"]:
+        data[name] = np.load(os.path.join(path, name + ".npy"), mmap_mode="r")[:meta["steps"]]
+    markers = os.path.join(path, "markers.npy")
+    if os.path.exists(markers):
+        data["markers"] = np.load(markers, mmap_mode="r")
+    return data
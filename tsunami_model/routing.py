@@ -0,0 +1,133 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from scipy.spatial import cKDTree
+import shapely
+from shapely.ops import unary_union
+
+NO_MARKER = -1
+
+# Zero-length edges would disappear from a sparse graph
+MIN_EDGE_LENGTH = 1e-9
+
+
+def distance_to_areas(x, y, areas):
+    """
+    Straight-line distance of every point to the closest of `areas`, in one vectorized call
+    """
+    zone = unary_union([area.shape for area in areas])
+    return shapely.distance(zone, shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float)))
+
+
+class RoutingGraph:
+    """Directed routing graph over marker points, stored as arrays.
+
+    x, y:        coordinates of the markers
+    distance:    shortest-path distance of each marker to the zone, along the graph
+    next_hop:    index of the next marker on the shortest path to the zone (NO_MARKER if none)
+    second_hop:  index of the neighbor with the second shortest path through it (NO_MARKER if none)
+    """
+
+    def __init__(self, x, y, neighbors, zone_distance, exit_distance=0.0):
+        """
+        Build the graph and its next-hop tables in one pass
+        :param x:               x coordinates of the markers
+        :param y:               y coordinates of the markers
+        :param neighbors:       For each marker, the indices of the markers it can walk to
+        :param zone_distance:   Straight-line distance of each marker to the zone
+        :param exit_distance:   Markers at most this far from the zone lead into it, all others lead
+                                to the zone through their neighbors only
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.tree = cKDTree(np.column_stack((self.x, self.y)))
+        n = len(self.x)
+
+        # Edges to the neighbors, plus an edge from every exit marker to a virtual zone node
+        sources = np.repeat(np.arange(n), [len(nbrs) for nbrs in neighbors])
+        targets = np.concatenate([np.asarray(nbrs, dtype=np.int64) for nbrs in neighbors] + [np.empty(0, np.int64)])
+        lengths = np.maximum(np.hypot(self.x[sources] - self.x[targets], self.y[sources] - self.y[targets]),
+                             MIN_EDGE_LENGTH)
+        zone_distance = np.asarray(zone_distance, dtype=float)
+        exits = np.flatnonzero(zone_distance <= exit_distance)
+        rows = np.concatenate((sources, exits))
+        cols = np.concatenate((targets, np.full(len(exits), n)))
+        weights = np.concatenate((lengths, np.maximum(zone_distance[exits], MIN_EDGE_LENGTH)))
+        graph = csr_matrix((weights, (rows, cols)), shape=(n + 1, n + 1))
+
+        # Distances to the zone node are distances from it on the reversed graph,
+        # infinite for the markers that cannot reach the zone
+        self.distance = dijkstra(graph.T.tocsr(), directed=True, indices=n)[:n]
+
+        # Next hops: the two neighbors with the shortest paths to the zone through them,
+        # i.e. the smallest edge length plus distance of the neighbor
+        self.next_hop = np.full(n, NO_MARKER, dtype=np.int32)
+        self.second_hop = np.full(n, NO_MARKER, dtype=np.int32)
+        cost = lengths + self.distance[targets]
+        reachable = np.isfinite(cost)
+        sources, targets, cost = sources[reachable], targets[reachable], cost[reachable]
+        order = targets[np.lexsort((cost, sources))]  # Edges of every marker together, cheapest first
+        counts = np.bincount(sources, minlength=n)
+        first = np.cumsum(counts) - counts
+        self.next_hop[counts > 0] = order[first[counts > 0]]
+        self.second_hop[counts > 1] = order[first[counts > 1] + 1]
+
+    @classmethod
+    def from_tables(cls, x, y, distance, next_hop, second_hop):
+        """
+        Graph from precomputed tables, e.g. loaded from a cache
+        """
+        graph = cls.__new__(cls)
+        graph.x = np.asarray(x, dtype=float)
+        graph.y = np.asarray(y, dtype=float)
+        graph.tree = cKDTree(np.column_stack((graph.x, graph.y)))
+        graph.distance = np.asarray(distance, dtype=float)
+        graph.next_hop = np.asarray(next_hop, dtype=np.int32)
+        graph.second_hop = np.asarray(second_hop, dtype=np.int32)
+        return graph
+
+    @classmethod
+    def within_radius(cls, x, y, zone_distance, radius, exit_distance=0.0):
+        """
+        Graph where every marker links to all other markers within `radius`
+        """
+        tree = cKDTree(np.column_stack((x, y)))
+        neighbors = [
+            [j for j in nbrs if j != i] for i, nbrs in enumerate(tree.query_ball_point(tree.data, radius))
+        ]
+        return cls(x, y, neighbors, zone_distance, exit_distance)
+
+    @classmethod
+    def adaptive_radius(cls, x, y, zone_distance, start=10, step=5, exit_distance=0.0):
+        """
+        Graph where the search radius of every marker grows by `step`, from `start`,
+        until it reaches another marker, and then one step more
+        """
+        tree = cKDTree(np.column_stack((x, y)))
+        nearest, _ = tree.query(tree.data, k=2)
+        closest = nearest[:, 1]
+        rings = np.ceil(np.maximum(closest - start, 0) / step)
+        radius = start + (rings + 1) * step
+        neighbors = [
+            [j for j in nbrs if j != i] for i, nbrs in enumerate(tree.query_ball_point(tree.data, radius))
+        ]
+        return cls(x, y, neighbors, zone_distance, exit_distance)
+
+    def __len__(self):
+        return len(self.x)
+
+    def nearest(self, x, y):
+        """Distance and index of the closest marker to each point."""
+        return self.tree.query(np.column_stack((x, y)))
+
+    def coords(self, node):
+        """Coordinates of a marker as a list, or an empty tuple for NO_MARKER."""
+        if node == NO_MARKER:
+            return tuple()
+        return [float(self.x[node]), float(self.y[node])]
+
+    def get_next_marker(self, node):
+        return self.coords(self.next_hop[node])
+
+    def get_second_next_marker(self, node):
+        return self.coords(self.second_hop[node])
@@ -0,0 +1,53 @@
+import heapq
+import itertools
+
+from mesa.time import RandomActivation
+
+
+class ActivityScheduler(RandomActivation):
+    """RandomActivation that only activates the agents that can still act.
+
+    Agents are active, asleep or retired. Active agents are activated once per
+    step, in random order, as with RandomActivation. Sleeping agents wait in a
+    queue keyed by the time they wake up at, and are activated again from the
+    step at that time. Retired agents, e.g. persons that reached safety, are
+    never activated again, but stay in `retired` so that they can still be
+    counted. A step only costs the active agents and the agents that wake up.
+    """
+
+    def __init__(self, model):
+        super().__init__(model)
+        self.sleeping = {}  # Sleeping agents by unique_id, with the time they wake up at
+        self.retired = {}  # Retired agents by unique_id
+        self._wake_queue = []  # Heap of (wake time, sequence, agent)
+        self._sequence = itertools.count()
+
+    def sleep(self, agent, until):
+        """
+        Stop activating an agent until a given time
+        :param agent:   Agent of the schedule, or a new agent
+        :param until:   Time of the first step in which the agent is activated again
+        """
+        self._agents.pop(agent.unique_id, None)
+        self.sleeping[agent.unique_id] = (until, agent)
+        heapq.heappush(self._wake_queue, (until, next(self._sequence), agent))
+
+    def retire(self, agent):
+        """Stop activating an agent for good."""
+        self._agents.pop(agent.unique_id, None)
+        self.sleeping.pop(agent.unique_id, None)
+        self.retired[agent.unique_id] = agent
+
+    def wake(self):
+        """Activate the sleeping agents whose wake-up time has come."""
+        while self._wake_queue and self._wake_queue[0][0] <= self.time:
+            until, _, agent = heapq.heappop(self._wake_queue)
+            # Skip agents that were retired, or put back to sleep, in the meantime
+            if self.sleeping.get(agent.unique_id, (None, None)) == (until, agent):
+                del self.sleeping[agent.unique_id]
+                self._agents[agent.unique_id] = agent
+
+    def step(self):
+        """Wake the agents that are due, then activate all active agents once, in random order."""
+        self.wake()
+        super().step()
@@ -3,7 +3,7 @@ from mesa.visualization.modules import ChartModule, TextElement
 from mesa.visualization.UserParam import UserSettableParameter
 from model import TsunamiModel, PersonAgent
 from mesa_geo.visualization.MapModule import MapModule
-from tsunami_model.agents import MarkerAgent, MapAgent, MarkerRoadAgent
+from tsunami_model.agents import MapAgent
 
 
 class TsunamiText(TextElement):
@@ -76,8 +76,16 @@ def tsunami_draw(agent):
     return portrayal
 
 
+def retired_persons(model):
+    """
+    Persons that reached safety: they leave the GeoSpace, but stay on the map
+    """
+    return model.schedule.retired.values()
+
+
 tsunami_text = TsunamiText()
-map_element = MapModule(tsunami_draw, TsunamiModel.MAP_COORDS, 16, 800, 1200)
+map_element = MapModule(tsunami_draw, TsunamiModel.MAP_COORDS, 16, 800, 1200, binary=True,
+                        properties=["unique_id", "atype"], retired_method=retired_persons)
 clock_element = ClockElement()
 tsunami_chart = ChartModule(
     [
@@ -86,7 +94,8 @@ tsunami_chart = ChartModule(
         {"Label": "child_susceptible", "Color": "LightBlue"},
         {"Label": "child_off_beach", "Color": "DarkBlue"},
         {"Label": "off_beach", "Color": "Orange"},
-    ]
+    ],
+    data_collector_name="counts",
 )
 
 server = ModularServer(TsunamiModel, [map_element, clock_element, tsunami_text, tsunami_chart], "Figueirinha Beach Simulation",
@@ -0,0 +1,152 @@
+import math
+from enum import IntEnum
+
+import numpy as np
+from shapely import intersects_xy, prepare
+from shapely.ops import unary_union
+
+
+class SurfaceType(IntEnum):
+    """Codes of the surface grid"""
+
+    NONE = 0
+    SAND = 1
+    TRAIL = 2
+    PARKING = 3
+    STREET = 4
+
+
+class Zone(IntEnum):
+    """Codes of the zone grid"""
+
+    NONE = 0
+    OFF_BEACH = 1
+    SAFE = 2
+
+
+# Surface types
+NO_SURFACE = SurfaceType.NONE
+SAND = SurfaceType.SAND
+TRAIL = SurfaceType.TRAIL
+PARKING = SurfaceType.PARKING
+STREET = SurfaceType.STREET
+SURFACE_TYPES = {"map": SAND, "trail": TRAIL, "parking": PARKING, "street": STREET}
+
+# Zones
+NO_ZONE = Zone.NONE
+OFF_BEACH_ZONE = Zone.OFF_BEACH
+SAFE_ZONE = Zone.SAFE
+
+
+class SurfaceRaster:
+    """Static map areas rasterized once into compact uint8 grids.
+
+    surface: surface type of each cell (SAND, TRAIL, PARKING or STREET)
+    zone:    zone id of each cell (OFF_BEACH_ZONE for the escadas, SAFE_ZONE for the safe areas)
+    slow:    1 where sand is within `slow_distance`, i.e. where persons walk at their penalty speed
+    """
+
+    def __init__(self, map_areas, resolution=1.0, slow_distance=5):
+        """
+        Rasterize the map areas
+        :param map_areas:       MapAgents of the map
+        :param resolution:      Cell size, in map units
+        :param slow_distance:   Distance to sand below which persons are slowed down
+        """
+        self.resolution = resolution
+        sand = [area.shape for area in map_areas if SURFACE_TYPES[area.atype] == SAND]
+        slow_area = unary_union(sand).buffer(slow_distance)
+
+        # Grid covers every area, plus the slow margin around the sand
+        minx, miny, maxx, maxy = unary_union([area.shape for area in map_areas] + [slow_area]).bounds
+        self.minx, self.miny = minx, miny
+        self.width = int(math.ceil((maxx - minx) / resolution))
+        self.height = int(math.ceil((maxy - miny) / resolution))
+
+        self.surface = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.zone = np.zeros((self.height, self.width), dtype=np.uint8)
+        self.slow = np.zeros((self.height, self.width), dtype=np.uint8)
+
+        # Sand first, so that trails, parking and streets drawn on top of it win
+        for area in sorted(map_areas, key=lambda a: SURFACE_TYPES[a.atype] != SAND):
+            self._burn(self.surface, area.shape, SURFACE_TYPES[area.atype])
+            if "escadas" in area.unique_id:
+                self._burn(self.zone, area.shape, OFF_BEACH_ZONE)
+        for area in map_areas:
+            if "safe" in area.unique_id:
+                self._burn(self.zone, area.shape, SAFE_ZONE)
+        self._burn(self.slow, slow_area, 1)
+
+    @classmethod
+    def from_grids(cls, minx, miny, resolution, surface, zone, slow):
+        """
+        Raster from precomputed grids, e.g. loaded from a cache
+        """
+        raster = cls.__new__(cls)
+        raster.minx, raster.miny = float(minx), float(miny)
+        raster.resolution = float(resolution)
+        raster.surface = np.asarray(surface, dtype=np.uint8)
+        raster.zone = np.asarray(zone, dtype=np.uint8)
+        raster.slow = np.asarray(slow, dtype=np.uint8)
+        raster.height, raster.width = raster.surface.shape
+        return raster
+
+    def _burn(self, grid, shape, value):
+        """Set `value` in every cell whose center lies in `shape`."""
+        minx, miny, maxx, maxy = shape.bounds
+        col0, row0 = self.cell(minx, miny)
+        col1, row1 = self.cell(maxx, maxy)
+        col0, row0 = max(col0, 0), max(row0, 0)
+        col1, row1 = min(col1, self.width - 1), min(row1, self.height - 1)
+        if col0 > col1 or row0 > row1:
+            return
+        cols = np.arange(col0, col1 + 1)
+        rows = np.arange(row0, row1 + 1)
+        xs = self.minx + (cols + 0.5) * self.resolution
+        ys = self.miny + (rows + 0.5) * self.resolution
+        prepare(shape)
+        inside = intersects_xy(shape, xs[np.newaxis, :], ys[:, np.newaxis])
+        grid[row0:row1 + 1, col0:col1 + 1][inside] = value
+
+    def cell(self, x, y):
+        """Column and row of the cell containing (x, y)."""
+        return (int(math.floor((x - self.minx) / self.resolution)),
+                int(math.floor((y - self.miny) / self.resolution)))
+
+    def _lookup(self, grid, x, y):
+        col, row = self.cell(x, y)
+        if 0 <= col < self.width and 0 <= row < self.height:
+            return int(grid[row, col])
+        return 0
+
+    def _lookup_many(self, grid, x, y):
+        cols = np.floor((np.asarray(x) - self.minx) / self.resolution).astype(np.int64)
+        rows = np.floor((np.asarray(y) - self.miny) / self.resolution).astype(np.int64)
+        inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        values = np.zeros(cols.shape, dtype=np.uint8)
+        values[inside] = grid[rows[inside], cols[inside]]
+        return values
+
+    def surface_at(self, x, y):
+        """Surface type at a single point."""
+        return self._lookup(self.surface, x, y)
+
+    def zone_at(self, x, y):
+        """Zone id at a single point."""
+        return self._lookup(self.zone, x, y)
+
+    def is_slow(self, x, y):
+        """True if persons at this point walk at their penalty speed."""
+        return self._lookup(self.slow, x, y) == 1
+
+    def surfaces(self, x, y):
+        """Surface types at arrays of points."""
+        return self._lookup_many(self.surface, x, y)
+
+    def zones(self, x, y):
+        """Zone ids at arrays of points."""
+        return self._lookup_many(self.zone, x, y)
+
+    def slow_mask(self, x, y):
+        """Boolean array, True where persons walk at their penalty speed."""
+        return self._lookup_many(self.slow, x, y) == 1
@@ -0,0 +1,168 @@
+import hashlib
+import os
+
+import numpy as np
+import shapely
+
+from mesa_geo import AgentCreator, PointLayer
+
+from tsunami_model.agents import MapAgent
+from tsunami_model.routing import RoutingGraph, distance_to_areas
+from tsunami_model.surface import SurfaceRaster
+
+# Bump when the layout of the cache files, or the way their tables are computed, changes
+CACHE_VERSION = 2
+
+
+class World:
+    """Fully built static world of the model.
+
+    Holds the reprojected map areas and markers, the routing graphs of the
+    markers and the surface raster. It can be saved to and loaded from a
+    single NumPy .npz file, so that it is only built once per input.
+    """
+
+    def __init__(self, map_ids, map_shapes, beach_ids, beach_x, beach_y, road_ids, road_x, road_y,
+                 beach_routing, road_routing, surface):
+        self.map_ids = list(map_ids)
+        self.map_shapes = list(map_shapes)
+        self.beach_ids = list(beach_ids)
+        self.beach_x = np.asarray(beach_x, dtype=float)
+        self.beach_y = np.asarray(beach_y, dtype=float)
+        self.road_ids = list(road_ids)
+        self.road_x = np.asarray(road_x, dtype=float)
+        self.road_y = np.asarray(road_y, dtype=float)
+        self.beach_routing = beach_routing
+        self.road_routing = road_routing
+        self.surface = surface
+
+    @classmethod
+    def build(cls, map_file, beach_file, road_file, map_id="Nome", beach_id="id", road_id="id",
+              crs="epsg:3857", resolution=1.0, road_marker_radius=20):
+        """
+        Build the world from the GeoJSON files
+        :param map_file:            GeoJSON file of the map areas
+        :param beach_file:          GeoJSON file of the beach markers
+        :param road_file:           GeoJSON file of the road markers
+        :param map_id:              Field with the id of the map areas
+        :param beach_id:            Field with the id of the beach markers
+        :param road_id:             Field with the id of the road markers
+        :param crs:                 Coordinate reference system of the model
+        :param resolution:          Cell size of the surface raster
+        :param road_marker_radius:  Distance at which road markers are linked
+        """
+        map_areas, beach, road = cls.read_geojson(map_file, beach_file, road_file, map_id, beach_id, road_id, crs)
+        return cls.from_agents(map_areas, beach, road, resolution, road_marker_radius)
+
+    @staticmethod
+    def read_geojson(map_file, beach_file, road_file, map_id="Nome", beach_id="id", road_id="id", crs="epsg:3857"):
+        """
+        Read and reproject the GeoJSON files
+        :return:    Map areas, as agents without a model, and the beach and road markers, as PointLayers
+        """
+        map_areas = AgentCreator(MapAgent, {"model": None}, crs=crs).from_file(map_file, unique_id=map_id)
+        beach = PointLayer.from_file(beach_file, unique_id=beach_id, crs=crs, set_attributes=False)
+        road = PointLayer.from_file(road_file, unique_id=road_id, crs=crs, set_attributes=False)
+        return map_areas, beach, road
+
+    @classmethod
+    def from_agents(cls, map_areas, beach, road, resolution=1.0, road_marker_radius=20):
+        """
+        Preprocess the map areas and the PointLayers of the markers: routing graphs and surface raster
+        """
+        off_beach_area = [area for area in map_areas if "escadas" in area.unique_id]
+        safe_area = [area for area in map_areas if "safe" in area.unique_id]
+
+        return cls(
+            [area.unique_id for area in map_areas], [area.shape for area in map_areas],
+            beach.ids, beach.x, beach.y,
+            road.ids, road.x, road.y,
+            RoutingGraph.adaptive_radius(beach.x, beach.y, distance_to_areas(beach.x, beach.y, off_beach_area)),
+            RoutingGraph.within_radius(road.x, road.y, distance_to_areas(road.x, road.y, safe_area),
+                                       road_marker_radius),
+            SurfaceRaster(map_areas, resolution=resolution),
+        )
+
+    @classmethod
+    def cached(cls, cache_dir, map_file, beach_file, road_file, **params):
+        """
+        Load the world from `cache_dir`, or build it and save it there
+        The cache key is a hash of the input files and of the build parameters.
+        """
+        if cache_dir is None:
+            return cls.build(map_file, beach_file, road_file, **params)
+
+        path = os.path.join(cache_dir, cache_key((map_file, beach_file, road_file), params) + ".npz")
+        if os.path.exists(path):
+            return cls.load(path)
+
+        world = cls.build(map_file, beach_file, road_file, **params)
+        os.makedirs(cache_dir, exist_ok=True)
+        world.save(path)
+        return world
+
+    def save(self, path):
+        """Write the world to a .npz file, atomically."""
+        wkb = shapely.to_wkb(np.array(self.map_shapes, dtype=object))
+        tables = dict(
+            version=CACHE_VERSION,
+            map_ids=np.array(self.map_ids),
+            map_wkb=np.frombuffer(b"".join(wkb), dtype=np.uint8),
+            map_wkb_offsets=np.cumsum([0] + [len(b) for b in wkb]),
+            beach_ids=np.array(self.beach_ids),
+            beach_x=self.beach_x,
+            beach_y=self.beach_y,
+            road_ids=np.array(self.road_ids),
+            road_x=self.road_x,
+            road_y=self.road_y,
+            surface_origin=np.array([self.surface.minx, self.surface.miny, self.surface.resolution]),
+            surface=self.surface.surface,
+            zone=self.surface.zone,
+            slow=self.surface.slow,
+        )
+        for name, routing in (("beach", self.beach_routing), ("road", self.road_routing)):
+            tables[name + "_distance"] = routing.distance
+            tables[name + "_next_hop"] = routing.next_hop
+            tables[name + "_second_hop"] = routing.second_hop
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            np.savez(file, **tables)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a world written by `save`."""
+        with np.load(path) as tables:
+            if int(tables["version"]) != CACHE_VERSION:
+                raise ValueError("World cache {} has an unsupported version".format(path))
+            blob = tables["map_wkb"].tobytes()
+            offsets = tables["map_wkb_offsets"]
+            map_shapes = shapely.from_wkb(
+                np.array([blob[start:end] for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+            )
+            routings = [
+                RoutingGraph.from_tables(
+                    tables[name + "_x"], tables[name + "_y"], tables[name + "_distance"],
+                    tables[name + "_next_hop"], tables[name + "_second_hop"])
+                for name in ("beach", "road")
+            ]
+            minx, miny, resolution = tables["surface_origin"]
+            surface = SurfaceRaster.from_grids(
+                minx, miny, resolution, tables["surface"], tables["zone"], tables["slow"])
+            return cls(
+                tables["map_ids"].tolist(), list(map_shapes),
+                tables["beach_ids"].tolist(), tables["beach_x"], tables["beach_y"],
+                tables["road_ids"].tolist(), tables["road_x"], tables["road_y"],
+                routings[0], routings[1], surface,
+            )
+
+
+def cache_key(files, params):
+    """Hash of the contents of the input files and of the build parameters."""
+    digest = hashlib.sha256(str(CACHE_VERSION).encode())
+    for filename in files:
+        with open(filename, "rb") as file:
+            digest.update(file.read())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()[:32]